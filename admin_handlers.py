@@ -1,21 +1,33 @@
 from telegram import Update
 from telegram.ext import CallbackContext, ConversationHandler, MessageHandler, Filters, CallbackQueryHandler
-from database import Database
 from keyboards import Keyboards
+from shared_handlers import SharedHandlers
 from config import Config
+from executors import offload, db_executor, io_executor, ExecutorBusy
+from storage import blob_store
+from catalog import get_catalog, reload_catalog
+from metrics import metrics
+from export import export_calculations, FORMATS
+from outbox import notification
+from datetime import datetime, timedelta
 import os
+import sqlite3
 import logging
 
 # Состояния для ConversationHandler
 PROJECT_ADDRESS, PROJECT_DESCRIPTION, PROJECT_DESIGN, PROJECT_LOCK_CODE = range(4)
-BROADCAST_MESSAGE = range(1)
+BROADCAST_MESSAGE = 0
 
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-db = Database()
+# Незавершенные загрузки PDF дизайн-проектов по user_id администратора
+_design_downloads = {}
 
 class AdminHandlers:
+    # Состояния диалогов (используются при регистрации в main.py)
+    PROJECT_ADDRESS, PROJECT_DESCRIPTION, PROJECT_DESIGN, PROJECT_LOCK_CODE = PROJECT_ADDRESS, PROJECT_DESCRIPTION, PROJECT_DESIGN, PROJECT_LOCK_CODE
+    BROADCAST_MESSAGE = BROADCAST_MESSAGE
+    
     @staticmethod
     def admin_menu(update: Update, context: CallbackContext):
         user = update.effective_user
@@ -28,6 +40,100 @@ class AdminHandlers:
             reply_markup=Keyboards.main_menu('admin')
         )
     
+    @staticmethod
+    def reload_settings(update: Update, context: CallbackContext):
+        user = update.effective_user
+        if user.id not in Config.ADMIN_IDS:
+            update.message.reply_text("⛔ У вас нет доступа к этой команде.")
+            return
+        
+        try:
+            catalog = reload_catalog()
+        except Exception as e:
+            logger.error(f"Error reloading material catalog: {e}")
+            update.message.reply_text(f"❌ Не удалось перечитать каталог, оставлен прежний: {e}")
+            return
+        
+        update.message.reply_text(
+            f"✅ Настройки перечитаны.\n🧱 Материалов в каталоге: {len(catalog)}\n👨‍💻 Администраторов: {len(Config.ADMIN_IDS)}"
+        )
+    
+    @staticmethod
+    def _parse_export_args(args):
+        """Аргументы /export: формат и фильтры вида project=12 from=2024-01-01 to=2024-01-31"""
+        options = {'fmt': 'csv', 'project_id': None, 'since_ts': None, 'until_ts': None}
+        for arg in args:
+            key, _, value = arg.partition('=')
+            if not value and key.lower() in FORMATS:
+                options['fmt'] = key.lower()
+            elif key == 'project':
+                options['project_id'] = int(value)
+            elif key == 'from':
+                options['since_ts'] = int(datetime.strptime(value, '%Y-%m-%d').timestamp())
+            elif key == 'to':
+                # Дата окончания включается в выгрузку целиком
+                options['until_ts'] = int((datetime.strptime(value, '%Y-%m-%d') + timedelta(days=1)).timestamp())
+            else:
+                raise ValueError(f"Unknown export argument: {arg}")
+        return options
+    
+    @staticmethod
+    @offload(io_executor)
+    def export_data(update: Update, context: CallbackContext):
+        user = update.effective_user
+        if user.id not in Config.ADMIN_IDS:
+            update.message.reply_text("⛔ У вас нет доступа к этой команде.")
+            return
+        
+        try:
+            options = AdminHandlers._parse_export_args(context.args)
+        except ValueError:
+            update.message.reply_text(
+                "❌ Использование: /export [csv|xlsx] [project=ID] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД]"
+            )
+            return
+        
+        try:
+            path, count = export_calculations(context.db, **options)
+        except RuntimeError as e:
+            logger.warning(f"Export failed: {e}")
+            update.message.reply_text("❌ Выгрузка в XLSX недоступна на сервере, используйте /export csv")
+            return
+        
+        try:
+            if not count:
+                update.message.reply_text("📭 Нет расчетов по заданным условиям.")
+                return
+            with open(path, 'rb') as file:
+                context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=file,
+                    filename=f"calculations_{datetime.now():%Y%m%d_%H%M}.{options['fmt']}",
+                    caption=f"📤 Выгрузка расчетов: {count} строк"
+                )
+        finally:
+            os.remove(path)
+    
+    @staticmethod
+    def show_stats(update: Update, context: CallbackContext):
+        user = update.effective_user
+        if user.id not in Config.ADMIN_IDS:
+            update.message.reply_text("⛔ У вас нет доступа к этой команде.")
+            return
+        
+        update.message.reply_text(metrics.render_summary())
+    
+    @staticmethod
+    @offload(db_executor)
+    def rebuild_totals(update: Update, context: CallbackContext):
+        user = update.effective_user
+        if user.id not in Config.ADMIN_IDS:
+            update.message.reply_text("⛔ У вас нет доступа к этой команде.")
+            return
+        
+        rows, projects = context.db.rebuild_project_totals()
+        update.message.reply_text(f"✅ Итоги пересчитаны: {rows} строк по {projects} проектам.")
+    
     @staticmethod
     def manage_workers(update: Update, context: CallbackContext):
         user = update.effective_user
@@ -41,11 +147,12 @@ class AdminHandlers:
         )
     
     @staticmethod
+    @offload(db_executor)
     def show_pending_workers(update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
         
-        pending_workers = db.get_pending_workers()
+        pending_workers = context.db.get_pending_workers()
         if not pending_workers:
             query.edit_message_text("📭 Нет новых заявок на доступ.")
             return
@@ -68,36 +175,38 @@ class AdminHandlers:
         
         action, worker_id = query.data.split('_')
         worker_id = int(worker_id)
-        worker = db.get_user(worker_id)
+        worker = context.db.get_user(worker_id)
         
+        # Уведомление работника записывается в outbox в одной транзакции со сменой роли
         if action == 'approve':
-            db.update_user_role(worker_id, 'worker')
-            context.bot.send_message(
+            context.db.update_user_role(worker_id, 'worker', [notification(
                 worker_id,
                 "✅ Ваш запрос на доступ одобрен!\nТеперь вы можете использовать все функции бота.",
-                reply_markup=Keyboards.main_menu('worker')
-            )
+                Keyboards.main_menu('worker')
+            )])
+            context.bot_data['outbox'].wake()
             query.edit_message_text(f"✅ Пользователь @{worker['username']} одобрен.")
         else:
-            db.update_user_role(worker_id, 'rejected')
-            context.bot.send_message(
+            context.db.update_user_role(worker_id, 'rejected', [notification(
                 worker_id,
                 "❌ Ваш запрос на доступ был отклонен администратором."
-            )
+            )])
+            context.bot_data['outbox'].wake()
             query.edit_message_text(f"❌ Пользователь @{worker['username']} отклонен.")
     
     @staticmethod
+    @offload(db_executor)
     def show_workers_list(update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
         
-        workers = db.get_all_workers()
+        workers = context.db.get_all_workers()
         if not workers:
             query.edit_message_text("👷 Нет зарегистрированных работников.")
             return
         
         workers_list = "\n".join(
-            [f"👤 {w['first_name']} {w['last_name']} (@{w['username']}) - 🆔 {w['user_id']}" 
+            [f"👤 {w['first_name']} {w['last_name']} (@{w['username']}) - 🆔 {w['user_id']}"
              for w in workers]
         )
         
@@ -105,12 +214,16 @@ class AdminHandlers:
     
     @staticmethod
     def start_add_project(update: Update, context: CallbackContext):
+        # Вход в диалог - кнопкой меню или inline-кнопкой из списка проектов
+        if update.callback_query:
+            update.callback_query.answer()
         user = update.effective_user
         if user.id not in Config.ADMIN_IDS:
-            update.message.reply_text("⛔ У вас нет доступа к этой команде.")
+            update.effective_message.reply_text("⛔ У вас нет доступа к этой команде.")
             return
         
-        update.message.reply_text(
+        SharedHandlers.close_project_picker(context)
+        update.effective_message.reply_text(
             "🏗 Введите адрес объекта:",
             reply_markup=Keyboards.back_keyboard()
         )
@@ -118,6 +231,10 @@ class AdminHandlers:
     
     @staticmethod
     def get_project_address(update: Update, context: CallbackContext):
+        if context.db.get_project_by_address(update.message.text):
+            update.message.reply_text("❌ Проект с таким адресом уже существует. Введите другой адрес:")
+            return PROJECT_ADDRESS
+        
         context.user_data['project_address'] = update.message.text
         update.message.reply_text("📝 Введите описание проекта:")
         return PROJECT_DESCRIPTION
@@ -135,37 +252,99 @@ class AdminHandlers:
             return PROJECT_DESIGN
         
         design_file = update.message.document
-        design_path = os.path.join(Config.TEMP_DIR, design_file.file_name)
-        
-        os.makedirs(Config.TEMP_DIR, exist_ok=True)
         
-        file = context.bot.get_file(design_file.file_id)
-        file.download(design_path)
+        # Скачивание в хранилище идет в пуле ввода-вывода, пока администратор вводит код замка
+        try:
+            _design_downloads[update.effective_user.id] = io_executor.submit(
+                AdminHandlers._download_design, context.bot, design_file.file_id
+            )
+        except ExecutorBusy:
+            update.message.reply_text("⏳ Бот перегружен, отправьте файл еще раз через несколько секунд.")
+            return PROJECT_DESIGN
         
-        context.user_data['project_design_path'] = design_path
+        context.user_data['project_design_file_name'] = design_file.file_name
+        context.user_data['project_design_file_id'] = design_file.file_id
         update.message.reply_text("🔑 Введите код доступа к замку:")
         return PROJECT_LOCK_CODE
     
+    @staticmethod
+    def _download_design(bot, file_id):
+        return blob_store.put_telegram_file(bot.get_file(file_id))
+    
     @staticmethod
     def get_project_lock_code(update: Update, context: CallbackContext):
-        lock_code = update.message.text
-        project_id = db.add_project(
-            context.user_data['project_address'],
-            context.user_data['project_description'],
-            context.user_data['project_design_path'],
-            lock_code,
-            update.effective_user.id
-        )
+        # Данные проекта забираем из user_data в потоке диспетчера: диалог завершается сразу,
+        # а проект создается, когда закончится загрузка дизайн-проекта
+        project = {
+            'address': context.user_data['project_address'],
+            'description': context.user_data['project_description'],
+            'lock_code': update.message.text,
+            'design_file_id': context.user_data.get('project_design_file_id'),
+            'design_file_name': context.user_data.get('project_design_file_name'),
+        }
+        context.user_data.clear()
         
-        update.message.reply_text(
-            f"✅ Проект успешно добавлен (ID: {project_id})",
-            reply_markup=Keyboards.main_menu('admin')
-        )
+        download = _design_downloads.pop(update.effective_user.id, None)
+        if download is None and project['design_file_id']:
+            # Диалог восстановлен после перезапуска бота - фоновой загрузки уже нет, скачиваем заново
+            try:
+                download = io_executor.submit(AdminHandlers._download_design, context.bot, project['design_file_id'])
+            except ExecutorBusy:
+                logger.warning("io executor is full, cannot download design file")
         
-        # Очистка временных данных
-        context.user_data.clear()
+        if download is None:
+            update.message.reply_text(
+                "❌ Не удалось загрузить файл дизайн-проекта. Создание проекта отменено.",
+                reply_markup=Keyboards.main_menu('admin')
+            )
+            return ConversationHandler.END
+        
+        download.add_done_callback(lambda future: AdminHandlers._finish_project(update, context, project, future))
         return ConversationHandler.END
     
+    @staticmethod
+    def _finish_project(update: Update, context: CallbackContext, project, download):
+        """Создание проекта после загрузки файла: в потоке загрузки или сразу, если файл уже скачан"""
+        try:
+            try:
+                design_blob = download.result()
+            except Exception as e:
+                logger.error(f"Error downloading design file: {e}")
+                update.message.reply_text(
+                    "❌ Не удалось загрузить файл дизайн-проекта. Создание проекта отменено.",
+                    reply_markup=Keyboards.main_menu('admin')
+                )
+                return
+            
+            try:
+                project_id = context.db.add_project(
+                    project['address'],
+                    project['description'],
+                    blob_store.path_for(design_blob),
+                    project['lock_code'],
+                    update.effective_user.id,
+                    design_file_id=project['design_file_id'],
+                    design_blob=design_blob,
+                    design_file_name=project['design_file_name']
+                )
+            except sqlite3.IntegrityError:
+                update.message.reply_text(
+                    "❌ Проект с таким адресом уже существует.",
+                    reply_markup=Keyboards.main_menu('admin')
+                )
+                return
+            
+            update.message.reply_text(
+                f"✅ Проект успешно добавлен (ID: {project_id})",
+                reply_markup=Keyboards.main_menu('admin')
+            )
+        except Exception as e:
+            # Исключение в done-callback future только попало бы в лог concurrent.futures
+            if context.dispatcher.error_handlers:
+                context.dispatcher.dispatch_error(update, e)
+            else:
+                logger.exception("Error finishing project creation")
+    
     @staticmethod
     def cancel_project_creation(update: Update, context: CallbackContext):
         user = update.effective_user
@@ -174,62 +353,55 @@ class AdminHandlers:
             reply_markup=Keyboards.main_menu('admin')
         )
         
-        # Удаление временных файлов
-        if 'project_design_path' in context.user_data:
-            try:
-                os.remove(context.user_data['project_design_path'])
-            except:
-                pass
+        # Незаконченную загрузку отменяем; уже сохраненный файл может использоваться
+        # другими проектами с тем же содержимым, поэтому из хранилища его не удаляем
+        download = _design_downloads.pop(update.effective_user.id, None)
+        if download is not None:
+            download.cancel()
         
         context.user_data.clear()
         return ConversationHandler.END
     
     @staticmethod
     def show_projects_list(update: Update, context: CallbackContext):
-        projects = db.get_projects()
-        if not projects:
-            update.message.reply_text("📭 Нет добавленных проектов.")
-            return
-        
-        update.message.reply_text(
-            "🏗 Выберите проект:",
-            reply_markup=Keyboards.projects_keyboard(projects)
-        )
+        SharedHandlers.send_project_picker(update, context, "🏗 Выберите проект или добавьте новый:", can_add=True)
     
     @staticmethod
     def show_project_details(update: Update, context: CallbackContext):
-        project_address = update.message.text[2:]  # Убираем эмодзи
-        projects = db.get_projects()
-        
-        for project in projects:
-            if project['address'] == project_address:
-                message = (f"🏠 Адрес: {project['address']}\n"
-                          f"📅 Дата создания: {project['created_at']}\n"
-                          f"👤 Ответственный: {project['first_name']} {project['last_name']}\n"
-                          f"📝 Описание: {project['description']}")
-                
-                update.message.reply_text(
-                    message,
-                    reply_markup=Keyboards.project_details_keyboard(project['project_id'])
-                )
-                break
+        SharedHandlers.close_project_picker(context)
+        AdminHandlers._send_project_details(update, context)
     
     @staticmethod
+    @offload(db_executor)
+    def _send_project_details(update: Update, context: CallbackContext):
+        project = SharedHandlers.selected_project(update, context)
+        if not project:
+            update.effective_message.reply_text("❌ Проект не найден.")
+            return
+        
+        message = (f"🏠 Адрес: {project['address']}\n"
+                  f"📅 Дата создания: {project['created_at']}\n"
+                  f"👤 Ответственный: {project['first_name']} {project['last_name']}\n"
+                  f"📝 Описание: {project['description']}")
+        
+        update.effective_message.reply_text(
+            message,
+            reply_markup=Keyboards.project_details_keyboard(project['project_id'])
+        )
+    
+    @staticmethod
+    @offload(io_executor)
     def project_details_callback(update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
         
-        action, project_id = query.data.split('_')
-        project = db.get_project(project_id)
+        parts = query.data.split('_')
+        action, project_id = parts[0], int(parts[1])
+        project = context.db.get_project(project_id)
         
         if action == 'design':
             try:
-                with open(project['design_pdf_path'], 'rb') as file:
-                    context.bot.send_document(
-                        chat_id=query.message.chat_id,
-                        document=file,
-                        caption=f"📄 Дизайн-проект для {project['address']}"
-                    )
+                SharedHandlers.send_project_design(context, query.message.chat_id, project)
             except Exception as e:
                 logger.error(f"Error sending design file: {e}")
                 query.edit_message_text("❌ Ошибка при загрузке файла.")
@@ -237,18 +409,34 @@ class AdminHandlers:
         elif action == 'lock':
             query.edit_message_text(f"🔑 Код замка для {project['address']}: {project['lock_code']}")
         
+        elif action == 'totals':
+            query.edit_message_text(SharedHandlers.project_totals_text(context, project))
+        
         elif action == 'calculations':
-            calculations = db.get_user_calculations(project['created_by'])
+            before_id = int(parts[2]) if len(parts) > 2 else None
+            page_size = Config.CALCULATIONS_PAGE_SIZE
+            calculations = context.db.get_project_calculations(
+                project_id, before_id=before_id, limit=page_size + 1
+            )
             if not calculations:
                 query.edit_message_text("📭 Нет расчетов для этого проекта.")
                 return
             
+            next_before_id = None
+            if len(calculations) > page_size:
+                calculations = calculations[:page_size]
+                next_before_id = calculations[-1]['calculation_id']
+            
+            catalog = get_catalog()
             calc_list = "\n".join(
-                [f"🧱 {c['material_type']} - {c['quantity']} {Config.MATERIALS[c['material_type'].lower()]['unit']} (Площадь: {c['area']} м²)"
-                 for c in calculations if c['project_id'] == int(project_id)]
+                [f"🧱 {c['material_type']} - {c['quantity']} {catalog.unit(c['material_type'])} (Площадь: {c['area']} м²)"
+                 for c in calculations]
             )
             
-            query.edit_message_text(f"📊 Расчеты для {project['address']}:\n\n{calc_list}")
+            query.edit_message_text(
+                f"📊 Расчеты для {project['address']}:\n\n{calc_list}",
+                reply_markup=Keyboards.calculations_page_keyboard(project_id, before_id, next_before_id)
+            )
     
     @staticmethod
     def start_broadcast(update: Update, context: CallbackContext):
@@ -278,20 +466,21 @@ class AdminHandlers:
         query.answer()
         
         if query.data == 'broadcast_confirm':
-            workers = db.get_all_workers()
-            message = context.user_data['broadcast_message']
-            
-            success = 0
-            failed = 0
+            message = context.user_data.get('broadcast_message')
+            if not message:
+                query.edit_message_text("❌ Нет сообщения для рассылки.")
+                return
             
-            for worker in workers:
-                try:
-                    context.bot.send_message(worker['user_id'], f"📢 Сообщение от администратора:\n\n{message}")
-                    success += 1
-                except:
-                    failed += 1
+            workers = context.db.get_all_workers()
+            status = query.edit_message_text(f"📤 Рассылка запущена: 0 из {len(workers)}")
             
-            query.edit_message_text(f"✅ Сообщение отправлено {success} работникам.\nНе удалось отправить: {failed}")
+            # Отправка идет в фоне, обработчик сразу освобождает поток диспетчера
+            context.bot_data['broadcast_engine'].start(
+                [worker['user_id'] for worker in workers],
+                f"📢 Сообщение от администратора:\n\n{message}",
+                status_chat_id=status.chat_id,
+                status_message_id=status.message_id
+            )
         
         elif query.data == 'broadcast_edit':
             query.edit_message_text("📢 Введите новое сообщение для рассылки:")
@@ -308,16 +497,4 @@ class AdminHandlers:
             reply_markup=Keyboards.main_menu('admin')
         )
         context.user_data.clear()
-        return ConversationHandler.END
-    
-    @staticmethod
-    def show_messages(update: Update, context: CallbackContext):
-        user = update.effective_user
-        messages = db.get_user_messages(user.id)
-        
-        if not messages:
-            update.message.reply_text("📭 У вас нет новых сообщений.")
-            return
-        
-        for msg in messages[:5]:  # Показываем последние 5 сообщений
-            update.message.reply_text(f"📩 От {msg['sender_name']}:\n\n{msg['text']}")
\ No newline at end of file
+        return ConversationHandler.END
\ No newline at end of file
@@ -0,0 +1,484 @@
+"""Бенчмарк обработчиков бота без сети.
+
+Собирает тот же Dispatcher, что и main.main(), но с Bot, который записывает
+вызовы API вместо отправки запросов в Telegram. Прогоняет синтетические потоки
+обновлений (калькулятор, просмотр проектов, заявки, рассылка, сообщения) для N
+пользователей на заполненной тестовой базе и печатает p50/p95/p99 задержек,
+пропускную способность и число обращений к базе по каждому обработчику.
+
+    python bench.py --users 50 --rounds 5 --projects 200
+"""
+import argparse
+import inspect
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from queue import Queue
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Собственные счетчики по текущему обработчику (поток диспетчера один, но рассылка идет в фоне)
+_current = threading.local()
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.db_calls = defaultdict(int)
+        self.api_calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+    
+    def count_db(self):
+        name = getattr(_current, 'handler', None) or '<background>'
+        with self._lock:
+            self.db_calls[name] += 1
+    
+    def count_api(self):
+        name = getattr(_current, 'handler', None) or '<background>'
+        with self._lock:
+            self.api_calls[name] += 1
+
+class StubRequest:
+    """Заменяет telegram.utils.request.Request: отвечает правдоподобными данными без сети"""
+    
+    def __init__(self, stats, bot_id, design_path):
+        self.stats = stats
+        self.bot_id = bot_id
+        self.design_path = design_path
+        self.calls = defaultdict(int)
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self.con_pool_size = 8
+    
+    def _message(self, data, **extra):
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = int(data.get('chat_id', 0))
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': self.bot_id, 'is_bot': True, 'first_name': 'Bench'},
+            'text': data.get('text', ''),
+        }
+        message.update(extra)
+        return message
+    
+    def post(self, url, data=None, timeout=None):
+        data = data or {}
+        method = url.rsplit('/', 1)[-1]
+        with self._lock:
+            self.calls[method] += 1
+        self.stats.count_api()
+        
+        if method == 'getMe':
+            return {'id': self.bot_id, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(data)
+        if method == 'sendDocument':
+            return self._message(data, document={'file_id': f"doc-{data.get('chat_id')}", 'file_unique_id': 'doc'})
+        if method == 'getFile':
+            return {'file_id': data.get('file_id'), 'file_unique_id': 'file', 'file_path': self.design_path}
+        return True
+    
+    def retrieve(self, url, timeout=None):
+        with open(self.design_path, 'rb') as f:
+            return f.read()
+    
+    def download(self, url, filename, timeout=None):
+        shutil.copyfile(self.design_path, filename)
+    
+    def stop(self):
+        pass
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+        self.message_id = 0
+    
+    def _next_ids(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+    
+    @staticmethod
+    def _user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'last_name': 'Bench',
+                'username': f'user{user_id}'}
+    
+    def text(self, user_id, text):
+        from telegram import Update
+        update_id, message_id = self._next_ids()
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                   'from': self._user(user_id), 'text': text}
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return Update.de_json({'update_id': update_id, 'message': message}, self.bot)
+    
+    def callback(self, user_id, data):
+        from telegram import Update
+        update_id, message_id = self._next_ids()
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'},
+                   'from': {'id': self.bot.id, 'is_bot': True, 'first_name': 'Bench'}, 'text': '...'}
+        query = {'id': str(update_id), 'from': self._user(user_id), 'chat_instance': str(user_id),
+                 'message': message, 'data': data}
+        return Update.de_json({'update_id': update_id, 'callback_query': query}, self.bot)
+
+def seed_database(db, rng, admin_id, workers, projects, calculations_per_worker, messages_per_user, materials, design_path):
+    for user_id in workers:
+        db.add_user(user_id, f'user{user_id}', f'User{user_id}', 'Bench', 'worker')
+    db.add_user(admin_id, 'admin', 'Admin', 'Bench', 'admin')
+    
+    project_ids = []
+    for i in range(projects):
+        project_ids.append(db.add_project(f'ул. Тестовая, д. {i + 1}', f'Объект №{i + 1}', design_path,
+                                          str(1000 + i), admin_id))
+    
+    for user_id in workers:
+        for _ in range(calculations_per_worker):
+            db.add_calculation(user_id, rng.choice(project_ids), rng.choice(materials), round(rng.uniform(5, 120), 1),
+                               rng.choice([0, 5, 10, 20]), round(rng.uniform(10, 500), 2))
+        for _ in range(messages_per_user):
+            db.add_message(admin_id, user_id, 'Тестовое сообщение')
+            db.add_message(user_id, admin_id, 'Ответ работника')
+    return project_ids
+
+def scenarios(factory, rng, admin_id, worker_ids, pending_ids, project_ids, addresses, materials, catalog):
+    """Генерирует потоки обновлений: (сценарий, update)"""
+    def calculator(user_id):
+        material = rng.choice(materials)
+        yield factory.text(user_id, '📊 Калькулятор материалов')
+        yield factory.text(user_id, material)
+        yield factory.text(user_id, str(round(rng.uniform(5, 80), 1)))
+        if catalog.get(material).thickness_dependent:
+            yield factory.text(user_id, str(rng.choice([5, 10, 15])))
+        yield factory.callback(user_id, f'link_{rng.choice(project_ids)}')
+    
+    def browse(user_id):
+        project_id = rng.choice(project_ids)
+        yield factory.text(user_id, '🏗 Проекты')
+        yield factory.callback(user_id, f'projects_older_{rng.choice(project_ids)}')
+        # Поиск по последнему слову адреса (номер дома)
+        yield factory.text(user_id, addresses[project_ids.index(project_id)].split()[-1])
+        yield factory.callback(user_id, f'project_{project_id}')
+        yield factory.callback(user_id, f'calculations_{project_id}')
+        yield factory.callback(user_id, f'totals_{project_id}')
+        yield factory.callback(user_id, f'lock_{project_id}')
+        yield factory.callback(user_id, f'design_{project_id}')
+    
+    def inbox(user_id):
+        yield factory.text(user_id, '/start')
+        yield factory.text(user_id, '📩 Сообщения')
+        yield factory.text(user_id, '/message Нужна доставка штукатурки на объект')
+    
+    def approvals():
+        yield factory.text(admin_id, '👥 Работники')
+        yield factory.callback(admin_id, 'pending_workers')
+        if pending_ids:
+            pending_id = pending_ids.pop()
+            yield factory.text(pending_id, '🚪 Запросить доступ')
+            yield factory.callback(admin_id, f'approve_{pending_id}')
+        yield factory.callback(admin_id, 'workers_list')
+    
+    def broadcast():
+        yield factory.text(admin_id, '📢 Рассылка')
+        yield factory.text(admin_id, 'Завтра планерка в 8:00')
+        yield factory.callback(admin_id, 'broadcast_confirm')
+    
+    return {
+        'calculator': calculator,
+        'projects': browse,
+        'inbox': inbox,
+        'approvals': approvals,
+        'broadcast': broadcast,
+    }
+
+def instrument_dispatcher(dp, stats, inline):
+    """Оборачивает колбэки всех обработчиков (включая вложенные в ConversationHandler и MenuRouter) таймерами"""
+    from metrics import walk_callbacks
+    
+    def wrap(callback):
+        callback = inspect.unwrap(callback) if inline else callback
+        name = getattr(callback, '__qualname__', repr(callback))
+        
+        def timed(update, context):
+            _current.handler = name
+            started = time.perf_counter()
+            try:
+                return callback(update, context)
+            except Exception:
+                stats.errors[name] += 1
+                raise
+            finally:
+                stats.latencies[name].append(time.perf_counter() - started)
+                _current.handler = None
+        
+        return timed
+    
+    walk_callbacks(dp, wrap)
+
+def run_executors_inline():
+    """Задачи пулов выполняются сразу в вызывающем потоке.
+    
+    Обработчик может ставить в пул только часть работы (запрос к базе и ответ), а состояние
+    менять в потоке диспетчера - так эта часть попадает в статистику поставившего ее обработчика.
+    """
+    from concurrent.futures import Future
+    from executors import BoundedExecutor
+    
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    BoundedExecutor.submit = submit
+
+def post_updates(bot, dp, updates):
+    """Отправляет обновления POST-запросами на локальный WebhookServer, как это делает Telegram"""
+    import urllib.request
+    from webhook import WebhookServer, SECRET_HEADER
+    
+    server = WebhookServer(bot, dp.update_queue, 'bench-secret', host='127.0.0.1', port=0, path='/telegram')
+    ready = threading.Event()
+    dispatcher_thread = threading.Thread(target=dp.start, kwargs={'ready': ready}, name='dispatcher')
+    dispatcher_thread.start()
+    ready.wait()
+    server.start()
+    try:
+        for update in updates:
+            request = urllib.request.Request(
+                server.url, data=update.to_json().encode('utf-8'),
+                headers={'Content-Type': 'application/json', SECRET_HEADER: 'bench-secret'}
+            )
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        # Дожидаемся обработки всех принятых обновлений
+        dp.update_queue.join()
+    finally:
+        server.shutdown()
+        dp.stop()
+        dispatcher_thread.join()
+
+def instrument_database(stats):
+    """Считает вызовы публичных методов Database обработчиками.
+    
+    Учитывается только внешний вызов: методы, вызывающие другие публичные методы
+    (has_projects -> search_projects), и обертки metrics.timed не удваивают счет.
+    """
+    from database import Database
+    
+    depth = threading.local()
+    
+    for name, method in list(vars(Database).items()):
+        if name.startswith('_') or not callable(method):
+            continue
+        
+        def counted(self, *args, __method=method, **kwargs):
+            level = getattr(depth, 'value', 0)
+            if level == 0:
+                stats.count_db()
+            depth.value = level + 1
+            try:
+                return __method(self, *args, **kwargs)
+            finally:
+                depth.value = level
+        
+        setattr(Database, name, counted)
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    sys.path.insert(0, ROOT)
+    
+    # Конфигурация до импорта обработчиков: база и хранилище внутри рабочего каталога
+    from config import Config
+    Config.MATERIALS_FILE = os.path.join(ROOT, Config.MATERIALS_FILE)
+    Config.BROADCAST_GLOBAL_RATE = args.broadcast_rate
+    Config.BROADCAST_PER_CHAT_INTERVAL = 0
+    if args.db:
+        shutil.copyfile(args.db, os.path.join(workdir, Config.DATABASE_NAME))
+    os.chdir(workdir)
+    
+    design_path = os.path.join(workdir, 'design.pdf')
+    with open(design_path, 'wb') as f:
+        f.write(b'%PDF-1.4\n' + os.urandom(args.design_kb * 1024))
+    
+    stats = Stats()
+    instrument_database(stats)
+    
+    from telegram import Bot
+    from telegram.ext import Dispatcher, ContextTypes
+    from bot_context import BotContext
+    from catalog import get_catalog
+    from database import get_database
+    from persistence import SQLitePersistence
+    import main
+    
+    admin_id = Config.ADMIN_IDS[0]
+    rng = random.Random(args.seed)
+    catalog = get_catalog()
+    materials = [spec.name for spec in catalog]
+    
+    worker_ids = [100000 + i for i in range(args.users)]
+    pending_ids = [200000 + i for i in range(args.pending)]
+    seed_started = time.perf_counter()
+    db = get_database()
+    if args.db:
+        project_ids = [row['project_id'] for row in db.get_projects()]
+    else:
+        project_ids = seed_database(db, rng, admin_id, worker_ids, args.projects, args.calculations, args.messages,
+                                    materials, design_path)
+    for user_id in pending_ids:
+        db.add_user(user_id, f'user{user_id}', f'User{user_id}', 'Bench', 'pending')
+    db.flush_writes()
+    addresses = [db.get_project(project_id)['address'] for project_id in project_ids]
+    seed_time = time.perf_counter() - seed_started
+    
+    request = StubRequest(stats, bot_id=999999, design_path=design_path)
+    bot = Bot('999999:BENCH-TOKEN', request=request)
+    dp = Dispatcher(bot, Queue(), workers=1, use_context=True, context_types=ContextTypes(context=BotContext),
+                    persistence=SQLitePersistence(db))
+    main.setup_dispatcher(dp)
+    instrument_dispatcher(dp, stats, inline=not args.offload)
+    if not args.offload:
+        run_executors_inline()
+    
+    errors = []
+    dp.add_error_handler(lambda update, context: errors.append(repr(context.error)))
+    
+    factory = UpdateFactory(bot)
+    flows = scenarios(factory, rng, admin_id, worker_ids, pending_ids, project_ids, addresses, materials, catalog)
+    selected = args.scenarios.split(',') if args.scenarios else list(flows)
+    
+    # Последовательность обновлений: пользователи чередуются, как при реальной нагрузке,
+    # а сценарии одного пользователя идут друг за другом, не разрывая диалоги
+    def user_stream(names, user_id=None):
+        for _ in range(args.rounds):
+            names = names[:]
+            rng.shuffle(names)
+            for name in names:
+                yield from flows[name](user_id) if user_id is not None else flows[name]()
+    
+    admin_flows = [name for name in selected if name in ('approvals', 'broadcast')]
+    worker_flows = [name for name in selected if name not in admin_flows]
+    streams = [user_stream(worker_flows, user_id) for user_id in worker_ids] if worker_flows else []
+    if admin_flows:
+        streams.append(user_stream(admin_flows))
+    
+    updates = []
+    while streams:
+        for stream in list(streams):
+            update = next(stream, None)
+            if update is None:
+                streams.remove(stream)
+            else:
+                updates.append(update)
+    
+    started = time.perf_counter()
+    if args.webhook:
+        post_updates(bot, dp, updates)
+    else:
+        for update in updates:
+            dp.process_update(update)
+    elapsed = time.perf_counter() - started
+    
+    dp.bot_data['broadcast_engine'].shutdown(wait=True)
+    from executors import shutdown_executors
+    shutdown_executors(wait=True)
+    # Уведомления отправляются в фоне - дожидаемся, пока outbox опустеет
+    deadline = time.monotonic() + 10
+    while db.next_notification_ts() is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dp.bot_data['outbox'].shutdown()
+    db.close()
+    
+    report = {
+        'users': args.users,
+        'projects': len(project_ids),
+        'updates': len(updates),
+        'seconds': elapsed,
+        'updates_per_second': len(updates) / elapsed if elapsed else 0.0,
+        'seed_seconds': seed_time,
+        'errors': len(errors),
+        'api_calls': dict(request.calls),
+        'handlers': {},
+    }
+    for name, values in sorted(stats.latencies.items()):
+        report['handlers'][name] = {
+            'count': len(values),
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'db_calls_per_call': stats.db_calls[name] / len(values),
+            'api_calls_per_call': stats.api_calls[name] / len(values),
+            'errors': stats.errors[name],
+        }
+    
+    os.chdir(ROOT)
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report, errors
+
+def print_report(report, errors):
+    print(f"Updates: {report['updates']} from {report['users']} users over {report['projects']} projects")
+    print(f"Total: {report['seconds']:.3f}s, {report['updates_per_second']:.1f} updates/s "
+          f"(seeding {report['seed_seconds']:.2f}s), errors: {report['errors']}")
+    print()
+    header = f"{'handler':<48}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db/call':>9}{'api/call':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, row in report['handlers'].items():
+        print(f"{name:<48}{row['count']:>7}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+              f"{row['db_calls_per_call']:>9.2f}{row['api_calls_per_call']:>9.2f}")
+    print()
+    print('Bot API calls: ' + ', '.join(f'{method}={count}' for method, count in sorted(report['api_calls'].items())))
+    for error in errors[:10]:
+        print(f'ERROR: {error}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=20, help='число симулируемых работников')
+    parser.add_argument('--rounds', type=int, default=3, help='сколько раз каждый пользователь проходит сценарии')
+    parser.add_argument('--projects', type=int, default=100, help='число проектов в тестовой базе')
+    parser.add_argument('--calculations', type=int, default=50, help='расчетов на работника в тестовой базе')
+    parser.add_argument('--messages', type=int, default=20, help='сообщений на работника в тестовой базе')
+    parser.add_argument('--pending', type=int, default=10, help='заявок на доступ в тестовой базе')
+    parser.add_argument('--design-kb', type=int, default=256, help='размер тестового PDF в КБ')
+    parser.add_argument('--broadcast-rate', type=float, default=1000, help='лимит рассылки (сообщений/с)')
+    parser.add_argument('--scenarios', help='через запятую: calculator,projects,inbox,approvals,broadcast')
+    parser.add_argument('--db', help='использовать копию существующей базы вместо генерации')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--webhook', action='store_true',
+                        help='доставлять обновления через локальный webhook-сервер по HTTP')
+    parser.add_argument('--offload', action='store_true',
+                        help='не разворачивать @offload: замерять только постановку в пул')
+    parser.add_argument('--json', action='store_true', help='вывести отчет в JSON')
+    parser.add_argument('--keep', action='store_true', help='не удалять рабочий каталог')
+    args = parser.parse_args()
+    
+    report, errors = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report, errors)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,16 @@
+from telegram.ext import CallbackContext
+
+class BotContext(CallbackContext):
+    """Контекст обработчиков с данными, загружаемыми один раз на обновление"""
+    
+    def __init__(self, dispatcher):
+        super().__init__(dispatcher)
+        # Строка пользователя из базы, заполняется предобработчиком SharedHandlers.load_user
+        self.user_row = None
+        # Подходящие обработчики кнопки, заполняются MenuRouter
+        self.routes = None
+    
+    @property
+    def db(self):
+        # Общий экземпляр Database, регистрируется в bot_data в main.setup_dispatcher
+        return self.bot_data['db']
\ No newline at end of file
@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from telegram.error import RetryAfter, BadRequest, Unauthorized, ChatMigrated, NetworkError
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Token bucket: не более rate операций в секунду с допустимым всплеском burst"""
+    
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+class PerChatLimiter:
+    """Минимальный интервал между сообщениями в один и тот же чат"""
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, chat_id):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed.get(chat_id, 0))
+            self._next_allowed[chat_id] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+    
+    def forget(self, chat_id):
+        with self._lock:
+            self._next_allowed.pop(chat_id, None)
+
+class Broadcast:
+    """Состояние одной рассылки: счетчики для отчета о прогрессе"""
+    
+    def __init__(self, chat_ids, text, status_chat_id=None, status_message_id=None):
+        self.chat_ids = list(chat_ids)
+        self.text = text
+        self.status_chat_id = status_chat_id
+        self.status_message_id = status_message_id
+        self.sent = 0
+        self.failed = 0
+        self.done = threading.Event()
+    
+    @property
+    def total(self):
+        return len(self.chat_ids)
+
+class BroadcastEngine:
+    """Рассылка сообщений в фоновых потоках с общим лимитом скорости и повторами"""
+    
+    def __init__(self, bot, workers=Config.BROADCAST_WORKERS, global_rate=Config.BROADCAST_GLOBAL_RATE,
+                 per_chat_interval=Config.BROADCAST_PER_CHAT_INTERVAL, max_retries=Config.BROADCAST_MAX_RETRIES,
+                 progress_interval=Config.BROADCAST_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self._global_limiter = RateLimiter(global_rate)
+        self._chat_limiter = PerChatLimiter(per_chat_interval)
+        self._senders = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='broadcast')
+        self._coordinators = []
+        self._lock = threading.Lock()
+    
+    def start(self, chat_ids, text, status_chat_id=None, status_message_id=None):
+        broadcast = Broadcast(chat_ids, text, status_chat_id, status_message_id)
+        thread = threading.Thread(target=self._run, args=(broadcast,), name='broadcast-coordinator', daemon=True)
+        with self._lock:
+            self._coordinators = [t for t in self._coordinators if t.is_alive()]
+            self._coordinators.append(thread)
+        thread.start()
+        return broadcast
+    
+    def shutdown(self, wait=True):
+        if wait:
+            with self._lock:
+                coordinators = list(self._coordinators)
+            for thread in coordinators:
+                thread.join()
+        self._senders.shutdown(wait=wait)
+    
+    def _run(self, broadcast):
+        pending = {self._senders.submit(self._deliver, chat_id, broadcast.text) for chat_id in broadcast.chat_ids}
+        last_report = time.monotonic()
+        last_progress = None
+        
+        while pending:
+            finished, pending = wait(pending, timeout=self.progress_interval, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future.exception() is None and future.result():
+                    broadcast.sent += 1
+                else:
+                    broadcast.failed += 1
+            
+            progress = f"📤 Рассылка: отправлено {broadcast.sent} из {broadcast.total}, ошибок: {broadcast.failed}"
+            # Telegram отклоняет редактирование без изменений текста
+            if pending and progress != last_progress and time.monotonic() - last_report >= self.progress_interval:
+                self._report(broadcast, progress)
+                last_report = time.monotonic()
+                last_progress = progress
+        
+        logger.info(f"Broadcast finished: sent={broadcast.sent} failed={broadcast.failed}")
+        self._report(broadcast, f"✅ Сообщение отправлено {broadcast.sent} работникам.\n"
+                                f"Не удалось отправить: {broadcast.failed}", final=True)
+        broadcast.done.set()
+    
+    def _deliver(self, chat_id, text):
+        attempt = 0
+        while True:
+            self._chat_limiter.acquire(chat_id)
+            self._global_limiter.acquire()
+            try:
+                self.bot.send_message(chat_id, text)
+                return True
+            except RetryAfter as e:
+                # Telegram сам говорит, сколько ждать - не считаем это попыткой
+                logger.warning(f"Flood control for chat {chat_id}, retry in {e.retry_after}s")
+                time.sleep(e.retry_after)
+            except ChatMigrated as e:
+                self._chat_limiter.forget(chat_id)
+                chat_id = e.new_chat_id
+            except (BadRequest, Unauthorized) as e:
+                # Постоянные ошибки: бот заблокирован, чат не найден и т.п.
+                logger.warning(f"Broadcast to {chat_id} failed permanently: {e}")
+                return False
+            except NetworkError as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"Broadcast to {chat_id} failed after {attempt} attempts: {e}")
+                    return False
+                time.sleep(min(Config.BROADCAST_BACKOFF_BASE * 2 ** (attempt - 1), Config.BROADCAST_BACKOFF_MAX))
+            except Exception as e:
+                logger.error(f"Unexpected error broadcasting to {chat_id}: {e}")
+                return False
+    
+    def _report(self, broadcast, text, final=False):
+        if broadcast.status_chat_id is None or broadcast.status_message_id is None:
+            return
+        
+        for _ in range(2 if final else 1):
+            self._global_limiter.acquire()
+            try:
+                self.bot.edit_message_text(text, chat_id=broadcast.status_chat_id, message_id=broadcast.status_message_id)
+                return
+            except RetryAfter as e:
+                # Промежуточный отчет можно пропустить, итоговый отправляем после паузы
+                logger.warning(f"Broadcast status update delayed, retry after {e.retry_after}s")
+                if final:
+                    time.sleep(e.retry_after)
+            except Exception as e:
+                logger.error(f"Error updating broadcast status: {e}")
+                return
\ No newline at end of file
@@ -1,50 +1,96 @@
+import math
 from config import Config
+from catalog import get_catalog
+
+try:
+    import numpy as np
+except ImportError:  # без NumPy пакетный расчет выполняется обычным циклом
+    np = None
+
+# Подпись результата не зависит от расчета и собирается один раз
+_RESULT_FOOTER = f"ℹ️ С учетом коэффициента запаса {Config.SAFETY_FACTOR}"
+
+# Начиная с этого размера пакета расчет выполняется через NumPy
+NUMPY_BATCH_THRESHOLD = 32
 
 class MaterialCalculator:
     @staticmethod
-    def calculate_material(material_type, area, thickness=0):
-        material = Config.MATERIALS.get(material_type.lower())
-        if not material:
-            return None
-        
-        # Коэффициенты расхода для разных материалов (кг/м² на 1 мм толщины)
-        consumption_rates = {
-            'штукатурка': 1.8,
-            'стяжка': 2.0,
-            'краска': 0.15,
-            'затирка': 1.5,
-            'наливной пол': 1.7,
-            'кирпич': 50,  # шт/м²
-            'гипсокартон': 0.1,  # листов/м²
-            'плитка': 10,  # шт/м² (зависит от размера плитки)
-            'обои': 0.05,  # рулонов/м²
-            'лак': 0.1    # л/м²
-        }
+    def calculate_batch(materials, areas, thicknesses=0):
+        """Расчет количества для набора строк (материал, площадь, толщина).
         
-        rate = consumption_rates.get(material_type.lower(), 1)
+        Любой аргумент может быть скаляром - он применяется ко всем строкам,
+        например для перебора толщин одного материала. Возвращает список
+        float той же длины; для неизвестных материалов - NaN.
+        """
+        table = get_catalog()
+        if isinstance(materials, str):
+            codes = [table.code(materials)]
+        else:
+            codes = [table.code(material) for material in materials]
         
-        if material['thickness_dependent'] and thickness > 0:
-            quantity = area * rate * thickness * Config.SAFETY_FACTOR
+        if np is not None:
+            codes = np.asarray(codes, dtype=np.intp)
+            areas = np.asarray(areas, dtype=float)
+            thicknesses = np.asarray(thicknesses, dtype=float)
+            if max(codes.size, areas.size, thicknesses.size) >= NUMPY_BATCH_THRESHOLD:
+                return MaterialCalculator._calculate_numpy(table, codes, areas, thicknesses).tolist()
+            codes, areas, thicknesses = (a.tolist() if a.ndim else [a.item()] for a in (codes, areas, thicknesses))
         else:
-            quantity = area * rate * Config.SAFETY_FACTOR
+            areas = areas if isinstance(areas, (list, tuple)) else [areas]
+            thicknesses = thicknesses if isinstance(thicknesses, (list, tuple)) else [thicknesses]
+        
+        size = max(len(codes), len(areas), len(thicknesses))
+        codes, areas, thicknesses = (a * size if len(a) == 1 else a for a in (codes, areas, thicknesses))
+        if not len(codes) == len(areas) == len(thicknesses) == size:
+            raise ValueError("Batch arguments must have the same length")
         
-        return round(quantity, 2)
+        result = []
+        for code, area, thickness in zip(codes, areas, thicknesses):
+            if code < 0:
+                result.append(math.nan)
+                continue
+            if table.thickness_dependent[code] and thickness > 0:
+                quantity = area * table.rates[code] * thickness * Config.SAFETY_FACTOR
+            else:
+                quantity = area * table.rates[code] * Config.SAFETY_FACTOR
+            result.append(round(quantity, 2))
+        return result
+    
+    @staticmethod
+    def _calculate_numpy(table, codes, areas, thicknesses):
+        codes, areas, thicknesses = np.broadcast_arrays(codes, areas, thicknesses)
+        known = codes >= 0
+        safe_codes = np.where(known, codes, 0)
+        rates = table.rates_array[safe_codes]
+        layer = np.where(table.thickness_dependent_array[safe_codes] & (thicknesses > 0), thicknesses, 1.0)
+        raw = areas * rates * layer * Config.SAFETY_FACTOR
+        quantities = np.round(raw, 2)
+        # Вблизи середины между сотыми np.round может разойтись с round() из-за погрешности
+        # умножения на 100 - такие редкие значения округляем так же, как скалярный расчет
+        scaled = raw * 100
+        ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+        if ties.any():
+            quantities[ties] = [round(value, 2) for value in raw[ties].tolist()]
+        return np.where(known, quantities, np.nan)
+    
+    @staticmethod
+    def calculate_material(material_type, area, thickness=0):
+        quantity = MaterialCalculator.calculate_batch(material_type, area, thickness)[0]
+        if math.isnan(quantity):
+            return None
+        return float(quantity)
     
     @staticmethod
     def format_calculation_result(material_type, area, thickness, quantity):
-        material = Config.MATERIALS.get(material_type.lower())
-        unit = material['unit'] if material else 'ед.'
+        material = get_catalog().get(material_type)
+        unit = material.unit if material else 'ед.'
         
-        if material and material['thickness_dependent'] and thickness > 0:
-            return (f"📊 Результат расчета:\n\n"
-                    f"🧱 Материал: {material_type}\n"
-                    f"📏 Площадь: {area} м²\n"
-                    f"📐 Толщина слоя: {thickness} мм\n"
-                    f"🧮 Необходимое количество: {quantity} {unit}\n\n"
-                    f"ℹ️ С учетом коэффициента запаса {Config.SAFETY_FACTOR}")
-        else:
-            return (f"📊 Результат расчета:\n\n"
-                    f"🧱 Материал: {material_type}\n"
-                    f"📏 Площадь: {area} м²\n"
-                    f"🧮 Необходимое количество: {quantity} {unit}\n\n"
-                    f"ℹ️ С учетом коэффициента запаса {Config.SAFETY_FACTOR}")
\ No newline at end of file
+        # Строка толщины - единственное отличие двух вариантов результата
+        thickness_line = (f"📐 Толщина слоя: {thickness} мм\n"
+                          if material and material.thickness_dependent and thickness > 0 else "")
+        return (f"📊 Результат расчета:\n\n"
+                f"🧱 Материал: {material_type}\n"
+                f"📏 Площадь: {area} м²\n"
+                f"{thickness_line}"
+                f"🧮 Необходимое количество: {quantity} {unit}\n\n"
+                f"{_RESULT_FOOTER}")
\ No newline at end of file
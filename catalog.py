@@ -0,0 +1,109 @@
+import json
+import logging
+import threading
+from markup_cache import FrozenReplyKeyboardMarkup
+from config import Config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+def normalize_name(name):
+    """Ключ материала: нижний регистр, лишние пробелы убраны"""
+    return ' '.join(name.lower().split())
+
+class MaterialSpec:
+    """Описание материала: единица измерения, расход на м² и зависимость от толщины слоя"""
+    __slots__ = ('code', 'name', 'unit', 'rate', 'thickness_dependent')
+    
+    def __init__(self, code, name, unit, rate, thickness_dependent):
+        self.code = code
+        self.name = name
+        self.unit = unit
+        self.rate = float(rate)
+        self.thickness_dependent = bool(thickness_dependent)
+    
+    def __repr__(self):
+        return f"MaterialSpec({self.name!r}, {self.unit!r}, rate={self.rate}, thickness_dependent={self.thickness_dependent})"
+
+class MaterialCatalog:
+    """Неизменяемый снимок каталога материалов с заранее построенными таблицами и клавиатурой"""
+    
+    def __init__(self, specs):
+        self.specs = tuple(specs)
+        self.by_name = {normalize_name(spec.name): spec for spec in self.specs}
+        
+        # Таблицы по коду материала для пакетного расчета
+        self.rates = [spec.rate for spec in self.specs]
+        self.thickness_dependent = [spec.thickness_dependent for spec in self.specs]
+        if np is not None:
+            self.rates_array = np.array(self.rates, dtype=float)
+            self.thickness_dependent_array = np.array(self.thickness_dependent, dtype=bool)
+        
+        names = [spec.name for spec in self.specs]
+        buttons = [names[i:i+2] for i in range(0, len(names), 2)]
+        buttons.append(['🔙 Назад'])
+        self.keyboard = FrozenReplyKeyboardMarkup(buttons, resize_keyboard=True)
+    
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        
+        specs = []
+        for code, item in enumerate(data['materials']):
+            spec = MaterialSpec(code, item['name'], item['unit'], item['rate'], item.get('thickness_dependent', False))
+            if normalize_name(spec.name) in (normalize_name(s.name) for s in specs):
+                raise ValueError(f"Duplicate material in catalog: {spec.name}")
+            specs.append(spec)
+        if not specs:
+            raise ValueError("Material catalog is empty")
+        return cls(specs)
+    
+    def get(self, name):
+        spec = self.by_name.get(name)
+        if spec is None:
+            spec = self.by_name.get(normalize_name(name))
+        return spec
+    
+    def code(self, name):
+        spec = self.get(name)
+        return spec.code if spec else -1
+    
+    def unit(self, name, default='ед.'):
+        spec = self.get(name)
+        return spec.unit if spec else default
+    
+    def __contains__(self, name):
+        return self.get(name) is not None
+    
+    def __iter__(self):
+        return iter(self.specs)
+    
+    def __len__(self):
+        return len(self.specs)
+
+_catalog = None
+_reload_lock = threading.Lock()
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        with _reload_lock:
+            if _catalog is None:
+                _catalog = MaterialCatalog.from_file(Config.MATERIALS_FILE)
+    return _catalog
+
+def reload_catalog(path=None):
+    """Перечитывает каталог и настройки доступа. При ошибке остается прежний каталог"""
+    global _catalog
+    with _reload_lock:
+        catalog = MaterialCatalog.from_file(path or Config.MATERIALS_FILE)
+        # Подмена ссылки атомарна: обработчики видят либо старый, либо новый снимок целиком
+        _catalog = catalog
+    Config.reload_admin_ids()
+    logger.info(f"Material catalog reloaded: {len(catalog)} materials, admins: {Config.ADMIN_IDS}")
+    return catalog
\ No newline at end of file
@@ -1,4 +1,8 @@
 import os
+from dotenv import load_dotenv
+
+# Переменные окружения можно задать в файле .env
+load_dotenv()
 
 class Config:
     # Токен бота
@@ -9,26 +13,101 @@ class Config:
     
     # Настройки базы данных
     DATABASE_NAME = 'database.db'
+    DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5'))
+    DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+    DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '-16000'))  # отрицательное значение - в КБ
+    DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(64 * 1024 * 1024)))
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '128'))
+    
+    # Отложенная запись расчетов и сообщений: пачка фиксируется через WRITE_BEHIND_DELAY
+    # секунд после первой операции или при наборе WRITE_BEHIND_BATCH операций
+    WRITE_BEHIND_DELAY = float(os.getenv('WRITE_BEHIND_DELAY', '0.02'))
+    WRITE_BEHIND_BATCH = int(os.getenv('WRITE_BEHIND_BATCH', '200'))
+    WRITE_BEHIND_QUEUE = int(os.getenv('WRITE_BEHIND_QUEUE', '10000'))
+    # Пауза перед повтором пачки, если база занята другим писателем: растет вдвое до максимума
+    WRITE_BEHIND_RETRY_BASE = float(os.getenv('WRITE_BEHIND_RETRY_BASE', '0.05'))
+    WRITE_BEHIND_RETRY_MAX = float(os.getenv('WRITE_BEHIND_RETRY_MAX', '5'))
     
-    # Логирование
+    # Кэш пользователей (количество записей и время жизни в секундах)
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+    
+    # Логирование: JSON-строки, ротация по размеру со сжатием старых файлов
     LOG_FILE = 'bot.log'
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '10'))
+    
+    # Размер страницы при выводе расчетов
+    CALCULATIONS_PAGE_SIZE = 20
+    
+    # Размер страницы входящих сообщений и длина текста сообщения в списке
+    INBOX_PAGE_SIZE = 5
+    INBOX_PREVIEW_LENGTH = 500
+    
+    # Число проектов на странице списка выбора
+    PROJECTS_PAGE_SIZE = 8
+    
+    # Число клавиатур с параметрами (карточки и страницы проектов) в кэше
+    MARKUP_CACHE_SIZE = int(os.getenv('MARKUP_CACHE_SIZE', '512'))
     
     # Пути для временных файлов
     TEMP_DIR = 'temp'
     
-    # Материалы и их расчетные параметры
-    MATERIALS = {
-        'штукатурка': {'unit': 'кг/м²', 'thickness_dependent': True},
-        'стяжка': {'unit': 'кг/м²', 'thickness_dependent': True},
-        'краска': {'unit': 'л/м²', 'thickness_dependent': False},
-        'затирка': {'unit': 'кг/м²', 'thickness_dependent': True},
-        'наливной пол': {'unit': 'кг/м²', 'thickness_dependent': True},
-        'кирпич': {'unit': 'шт/м²', 'thickness_dependent': False},
-        'гипсокартон': {'unit': 'лист', 'thickness_dependent': False},
-        'плитка': {'unit': 'шт/м²', 'thickness_dependent': False},
-        'обои': {'unit': 'рулон', 'thickness_dependent': False},
-        'лак': {'unit': 'л/м²', 'thickness_dependent': False}
-    }
+    # Выгрузка расчетов (/export): число строк, читаемых из базы за раз
+    EXPORT_BATCH_SIZE = 500
+    
+    # Постоянное хранилище дизайн-проектов (файлы по SHA-256 содержимого)
+    STORAGE_DIR = os.getenv('STORAGE_DIR', 'storage')
+    
+    # Каталог материалов (единицы измерения и нормы расхода), перечитывается без перезапуска
+    MATERIALS_FILE = os.getenv('MATERIALS_FILE', 'materials.json')
+    
+    # Пулы потоков для работы с базой и для передачи файлов: число потоков,
+    # размер очереди и время ожидания места в очереди (секунды)
+    DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '4'))
+    DB_EXECUTOR_QUEUE = int(os.getenv('DB_EXECUTOR_QUEUE', '100'))
+    IO_EXECUTOR_WORKERS = int(os.getenv('IO_EXECUTOR_WORKERS', '4'))
+    IO_EXECUTOR_QUEUE = int(os.getenv('IO_EXECUTOR_QUEUE', '20'))
+    EXECUTOR_SUBMIT_TIMEOUT = float(os.getenv('EXECUTOR_SUBMIT_TIMEOUT', '2'))
+    DESIGN_DOWNLOAD_TIMEOUT = float(os.getenv('DESIGN_DOWNLOAD_TIMEOUT', '120'))
+    
+    # Рассылка: число потоков отправки, общий лимит сообщений в секунду,
+    # минимальный интервал между сообщениями в один чат и повторы при сетевых ошибках
+    BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+    BROADCAST_GLOBAL_RATE = float(os.getenv('BROADCAST_GLOBAL_RATE', '25'))
+    BROADCAST_PER_CHAT_INTERVAL = float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', '1'))
+    BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+    BROADCAST_BACKOFF_BASE = 1.0
+    BROADCAST_BACKOFF_MAX = 30.0
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '3'))
+    
+    # Уведомления через outbox: период опроса таблицы (секунды), размер выборки
+    # и экспоненциальная задержка повтора после ошибки сети
+    OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+    OUTBOX_BATCH_SIZE = 50
+    OUTBOX_BACKOFF_BASE = 2.0
+    OUTBOX_BACKOFF_MAX = 600.0
+    
+    # Режим получения обновлений: polling или webhook. В режиме webhook TLS завершается
+    # на обратном прокси, который передает запросы с WEBHOOK_URL на WEBHOOK_LISTEN:WEBHOOK_PORT
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # пустой - генерируется при запуске
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+    
+    # Адрес HTTP-сервера с метриками в формате Prometheus (порт 0 - сервер не запускается)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
     
     # Коэффициенты запаса материалов
-    SAFETY_FACTOR = 1.1
\ No newline at end of file
+    SAFETY_FACTOR = 1.1
+    
+    @classmethod
+    def reload_admin_ids(cls):
+        # Перечитываем .env, чтобы смена администраторов не требовала перезапуска
+        load_dotenv(override=True)
+        cls.ADMIN_IDS = [int(id) for id in os.getenv('ADMIN_IDS', '821813425').split(',')]
\ No newline at end of file
@@ -1,102 +1,179 @@
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from contextlib import contextmanager
 from config import Config
+from migrations import apply_migrations, PROJECT_TOTALS_BACKFILL
+from metrics import instrument_class
+from writebehind import WriteBehindQueue
 import os
 
+class UserCache:
+    """Ограниченный LRU-кэш строк пользователей с временем жизни записей"""
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+        # Счетчик инвалидаций: не кладем в кэш строку, прочитанную до изменения
+        self._generation = 0
+    
+    @property
+    def generation(self):
+        return self._generation
+    
+    def get(self, user_id):
+        with self._lock:
+            entry = self._rows.get(user_id)
+            if entry is None:
+                return False, None
+            row, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._rows[user_id]
+                return False, None
+            self._rows.move_to_end(user_id)
+            return True, row
+    
+    def put(self, user_id, row, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._rows[user_id] = (row, time.monotonic() + self.ttl)
+            self._rows.move_to_end(user_id)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+    
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._rows.pop(user_id, None)
+    
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._rows.clear()
+
 class Database:
+    # Кэши пользователей общие для всех экземпляров, работающих с одним файлом базы,
+    # иначе изменение роли через один экземпляр не было бы видно в другом
+    _user_caches = {}
+    _user_caches_lock = threading.Lock()
+    
     def __init__(self, db_name=Config.DATABASE_NAME):
         self.db_name = db_name
+        # Пул соединений: по одному соединению на поток, переиспользуется между вызовами
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Индекс адрес -> project_id для быстрого поиска проекта по кнопке
+        self._project_index = {}
+        self._project_index_lock = threading.Lock()
+        # Кэш пользователей: роль запрашивается почти на каждое обновление
+        with Database._user_caches_lock:
+            self._user_cache = Database._user_caches.setdefault(
+                os.path.abspath(db_name), UserCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+            )
         self._initialize_db()
+        self._load_project_index()
+        self._fts_enabled = self._table_exists('projects_fts')
+        # Расчеты и сообщения записываются пачками в фоновом потоке
+        self._writer = WriteBehindQueue(self._connect)
+    
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=Config.DB_BUSY_TIMEOUT,
+            cached_statements=Config.DB_STATEMENT_CACHE_SIZE,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        # WAL позволяет читателям работать параллельно с записью
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={Config.DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size={int(Config.DB_CACHE_SIZE)}')
+        conn.execute(f'PRAGMA mmap_size={int(Config.DB_MMAP_SIZE)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
     
     @contextmanager
     def _get_connection(self):
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
         try:
             yield conn
-        finally:
-            conn.close()
+        except Exception:
+            # Не оставляем незавершенную транзакцию на переиспользуемом соединении
+            conn.rollback()
+            raise
+    
+    def flush_writes(self, timeout=None):
+        """Ждет фиксации всех отложенных записей"""
+        self._writer.flush(timeout)
+    
+    def close(self):
+        # Сначала фиксируем отложенные записи: после close они уже на диске
+        self._writer.close()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
     
     def _initialize_db(self):
         with self._get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Таблица пользователей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    role TEXT CHECK(role IN ('admin', 'worker', 'pending')),
-                    registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица проектов
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS projects (
-                    project_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    address TEXT NOT NULL,
-                    description TEXT,
-                    design_pdf_path TEXT,
-                    lock_code TEXT,
-                    created_by INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (created_by) REFERENCES users(user_id)
-                )
-            ''')
-            
-            # Таблица расчетов
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS calculations (
-                    calculation_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    project_id INTEGER,
-                    material_type TEXT,
-                    area REAL,
-                    thickness REAL,
-                    quantity REAL,
-                    calculation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(user_id),
-                    FOREIGN KEY (project_id) REFERENCES projects(project_id)
-                )
-            ''')
-            
-            # Таблица сообщений
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sender_id INTEGER,
-                    recipient_id INTEGER,
-                    text TEXT,
-                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (sender_id) REFERENCES users(user_id),
-                    FOREIGN KEY (recipient_id) REFERENCES users(user_id)
-                )
-            ''')
-            
-            conn.commit()
+            apply_migrations(conn)
+    
+    def _table_exists(self, name):
+        with self._get_connection() as conn:
+            row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+        return row is not None
+    
+    def _load_project_index(self):
+        with self._get_connection() as conn:
+            rows = conn.execute('SELECT project_id, address FROM projects ORDER BY project_id').fetchall()
+        with self._project_index_lock:
+            self._project_index = {row['address']: row['project_id'] for row in rows}
     
     # Методы для работы с пользователями
-    def add_user(self, user_id, username, first_name, last_name, role='pending'):
+    def add_user(self, user_id, username, first_name, last_name, role='pending', notifications=()):
         with self._get_connection() as conn:
             conn.execute('''
-                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, role)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, role, registration_ts)
+                VALUES (?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
             ''', (user_id, username, first_name, last_name, role))
+            self._enqueue_notifications(conn, notifications)
             conn.commit()
+        self._user_cache.invalidate(user_id)
     
     def get_user(self, user_id):
+        found, row = self._user_cache.get(user_id)
+        if found:
+            return row
+        
+        generation = self._user_cache.generation
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            return cursor.fetchone()
+            row = cursor.fetchone()
+        self._user_cache.put(user_id, row, generation)
+        return row
     
-    def update_user_role(self, user_id, role):
+    def update_user_role(self, user_id, role, notifications=()):
         with self._get_connection() as conn:
             conn.execute('UPDATE users SET role = ? WHERE user_id = ?', (role, user_id))
+            self._enqueue_notifications(conn, notifications)
             conn.commit()
+        self._user_cache.invalidate(user_id)
     
     def get_pending_workers(self):
         with self._get_connection() as conn:
@@ -111,24 +188,30 @@ class Database:
             return cursor.fetchall()
     
     # Методы для работы с проектами
-    def add_project(self, address, description, design_pdf_path, lock_code, created_by):
+    def add_project(self, address, description, design_pdf_path, lock_code, created_by,
+                    design_file_id=None, design_blob=None, design_file_name=None):
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO projects (address, description, design_pdf_path, lock_code, created_by)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (address, description, design_pdf_path, lock_code, created_by))
+                INSERT INTO projects (address, description, design_pdf_path, lock_code, created_by,
+                                      design_file_id, design_blob, design_file_name, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+            ''', (address, description, design_pdf_path, lock_code, created_by,
+                  design_file_id, design_blob, design_file_name))
             conn.commit()
-            return cursor.lastrowid
+            project_id = cursor.lastrowid
+        with self._project_index_lock:
+            self._project_index[address] = project_id
+        return project_id
     
     def get_projects(self):
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT p.*, u.first_name, u.last_name 
+                SELECT p.*, u.first_name, u.last_name
                 FROM projects p
                 JOIN users u ON p.created_by = u.user_id
-                ORDER BY p.created_at DESC
+                ORDER BY p.created_ts DESC, p.project_id DESC
             ''')
             return cursor.fetchall()
     
@@ -138,44 +221,346 @@ class Database:
             cursor.execute('SELECT * FROM projects WHERE project_id = ?', (project_id,))
             return cursor.fetchone()
     
+    def set_project_design_file_id(self, project_id, design_file_id):
+        with self._get_connection() as conn:
+            conn.execute('UPDATE projects SET design_file_id = ? WHERE project_id = ?', (design_file_id, project_id))
+            conn.commit()
+    
+    def get_project_by_address(self, address):
+        with self._project_index_lock:
+            project_id = self._project_index.get(address)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            if project_id is None:
+                # Проект мог быть добавлен другим процессом - ищем по индексу адреса
+                cursor.execute('SELECT project_id FROM projects WHERE address = ?', (address,))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                project_id = row['project_id']
+                with self._project_index_lock:
+                    self._project_index[address] = project_id
+            
+            cursor.execute('''
+                SELECT p.*, u.first_name, u.last_name
+                FROM projects p
+                LEFT JOIN users u ON p.created_by = u.user_id
+                WHERE p.project_id = ?
+            ''', (project_id,))
+            return cursor.fetchone()
+    
+    def get_project_with_creator(self, project_id):
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT p.*, u.first_name, u.last_name
+                FROM projects p
+                LEFT JOIN users u ON p.created_by = u.user_id
+                WHERE p.project_id = ?
+            ''', (project_id,))
+            return cursor.fetchone()
+    
+    def _project_search(self, text):
+        """Часть запроса для поиска проектов: источник строк и условие по тексту"""
+        words = re.findall(r'\w+', text or '')
+        if not words:
+            return 'SELECT project_id, address FROM projects WHERE 1', [], 'project_id'
+        if self._fts_enabled:
+            # Каждое слово - префикс: «лен 1» найдет «ул. Ленина, 15»
+            match = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+            return ('SELECT rowid AS project_id, address FROM projects_fts WHERE projects_fts MATCH ?',
+                    [match], 'rowid')
+        conditions = ' AND '.join('(address LIKE ? OR description LIKE ?)' for _ in words)
+        params = [value for word in words for value in (f'%{word}%', f'%{word}%')]
+        return f'SELECT project_id, address FROM projects WHERE {conditions}', params, 'project_id'
+    
+    def search_projects(self, text=None, before_id=None, after_id=None, limit=Config.PROJECTS_PAGE_SIZE):
+        """Страница проектов, новые сверху, с поиском по началу слов адреса и описания (keyset)"""
+        query, params, key = self._project_search(text)
+        if after_id is not None:
+            query += f' AND {key} > ? ORDER BY {key} ASC LIMIT ?'
+            params += [after_id, limit]
+        else:
+            if before_id is not None:
+                query += f' AND {key} < ?'
+                params.append(before_id)
+            query += f' ORDER BY {key} DESC LIMIT ?'
+            params.append(limit)
+        
+        with self._get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return rows[::-1] if after_id is not None else rows
+    
+    def has_projects(self, text=None, before_id=None, after_id=None):
+        return bool(self.search_projects(text, before_id, after_id, limit=1))
+    
     # Методы для работы с расчетами
     def add_calculation(self, user_id, project_id, material_type, area, thickness, quantity):
-        with self._get_connection() as conn:
+        """Записывает расчет отложенно, в одной транзакции с итогами проекта. Возвращает Future записи"""
+        calculation_ts = int(time.time())
+        
+        def write(conn):
             conn.execute('''
-                INSERT INTO calculations (user_id, project_id, material_type, area, thickness, quantity)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, project_id, material_type, area, thickness, quantity))
+                INSERT INTO calculations (user_id, project_id, material_type, area, thickness, quantity, calculation_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, project_id, material_type, area, thickness, quantity, calculation_ts))
+            if project_id is not None:
+                # Итоги проекта обновляются в той же транзакции, что и сам расчет
+                conn.execute('''
+                    INSERT INTO project_material_totals (project_id, material_type, quantity, area, calculations)
+                    VALUES (?, ?, ?, ?, 1)
+                    ON CONFLICT (project_id, material_type) DO UPDATE SET
+                        quantity = quantity + excluded.quantity,
+                        area = area + excluded.area,
+                        calculations = calculations + 1
+                ''', (project_id, material_type, quantity, area))
+        
+        return self._writer.submit(write)
+    
+    def get_project_totals(self, project_id):
+        with self._get_connection() as conn:
+            return conn.execute('''
+                SELECT material_type, quantity, area, calculations
+                FROM project_material_totals
+                WHERE project_id = ?
+                ORDER BY material_type
+            ''', (project_id,)).fetchall()
+    
+    def rebuild_project_totals(self):
+        """Пересчитывает итоги по всем расчетам. Возвращает (число строк итогов, число проектов)"""
+        with self._get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM project_material_totals')
+            conn.execute(PROJECT_TOTALS_BACKFILL)
+            row = conn.execute('SELECT COUNT(*), COUNT(DISTINCT project_id) FROM project_material_totals').fetchone()
             conn.commit()
+            return row[0], row[1]
     
-    def get_user_calculations(self, user_id):
+    def get_project_calculations(self, project_id, user_id=None, before_id=None, limit=Config.CALCULATIONS_PAGE_SIZE):
+        """Страница расчетов проекта, новые сверху: старше before_id (keyset)"""
+        query = '''
+            SELECT calculation_id, user_id, project_id, material_type, area, thickness, quantity, calculation_ts
+            FROM calculations
+            WHERE project_id = ?
+        '''
+        params = [project_id]
+        if user_id is not None:
+            query += ' AND user_id = ?'
+            params.append(user_id)
+        if before_id is not None:
+            query += ' AND calculation_id < ?'
+            params.append(before_id)
+        query += ' ORDER BY calculation_id DESC LIMIT ?'
+        params.append(limit)
+        
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT c.*, p.address 
-                FROM calculations c
-                LEFT JOIN projects p ON c.project_id = p.project_id
-                WHERE c.user_id = ?
-                ORDER BY c.calculation_date DESC
-            ''', (user_id,))
+            cursor.execute(query, params)
             return cursor.fetchall()
     
+    def iter_calculations_export(self, project_id=None, since_ts=None, until_ts=None,
+                                 batch_size=Config.EXPORT_BATCH_SIZE):
+        """Расчеты с проектом и автором для выгрузки, по порядку calculation_id.
+        
+        Строки читаются из курсора пачками на отдельном соединении, поэтому
+        память не зависит от размера результата, а долгое чтение не занимает
+        соединение потока.
+        """
+        query = '''
+            SELECT c.calculation_id, c.calculation_ts, c.project_id, p.address, p.description,
+                   u.first_name, u.last_name, c.material_type, c.area, c.thickness, c.quantity
+            FROM calculations c
+            LEFT JOIN projects p ON c.project_id = p.project_id
+            LEFT JOIN users u ON c.user_id = u.user_id
+            WHERE 1
+        '''
+        params = []
+        if project_id is not None:
+            query += ' AND c.project_id = ?'
+            params.append(project_id)
+        if since_ts is not None:
+            query += ' AND c.calculation_ts >= ?'
+            params.append(since_ts)
+        if until_ts is not None:
+            query += ' AND c.calculation_ts < ?'
+            params.append(until_ts)
+        query += ' ORDER BY c.calculation_id'
+        
+        conn = self._connect()
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+    
     # Методы для работы с сообщениями
-    def add_message(self, sender_id, recipient_id, text):
+    def add_message(self, sender_id, recipient_id, text, notifications=()):
+        """Записывает сообщение (и уведомления о нем) отложенно. Возвращает Future записи"""
+        sent_ts = int(time.time())
+        
+        def write(conn):
+            conn.execute('''
+                INSERT INTO messages (sender_id, recipient_id, text, sent_ts)
+                VALUES (?, ?, ?, ?)
+            ''', (sender_id, recipient_id, text, sent_ts))
+            self._enqueue_notifications(conn, notifications)
+        
+        return self._writer.submit(write)
+    
+    def get_inbox_page(self, user_id, before_id=None, after_id=None, limit=Config.INBOX_PAGE_SIZE):
+        """Страница входящих, новые сверху: старше before_id или новее after_id (keyset)"""
+        query = '''
+            SELECT m.message_id, m.text, m.sent_ts, m.read_at, u.first_name as sender_name
+            FROM messages m
+            JOIN users u ON m.sender_id = u.user_id
+            WHERE m.recipient_id = ?
+        '''
+        params = [user_id]
+        if after_id is not None:
+            # Страница ближе к новым: берем ближайшие к after_id и разворачиваем
+            query += ' AND m.message_id > ? ORDER BY m.message_id ASC LIMIT ?'
+            params += [after_id, limit]
+        else:
+            if before_id is not None:
+                query += ' AND m.message_id < ?'
+                params.append(before_id)
+            query += ' ORDER BY m.message_id DESC LIMIT ?'
+            params.append(limit)
+        
+        with self._get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return rows[::-1] if after_id is not None else rows
+    
+    def has_inbox_messages(self, user_id, before_id=None, after_id=None):
+        with self._get_connection() as conn:
+            if after_id is not None:
+                row = conn.execute(
+                    'SELECT 1 FROM messages WHERE recipient_id = ? AND message_id > ? LIMIT 1', (user_id, after_id)
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    'SELECT 1 FROM messages WHERE recipient_id = ? AND message_id < ? LIMIT 1', (user_id, before_id)
+                ).fetchone()
+            return row is not None
+    
+    def count_unread_messages(self, user_id):
+        with self._get_connection() as conn:
+            return conn.execute(
+                'SELECT COUNT(*) FROM messages WHERE recipient_id = ? AND read_at IS NULL', (user_id,)
+            ).fetchone()[0]
+    
+    def mark_messages_read(self, user_id, min_id, max_id):
         with self._get_connection() as conn:
             conn.execute('''
-                INSERT INTO messages (sender_id, recipient_id, text)
-                VALUES (?, ?, ?)
-            ''', (sender_id, recipient_id, text))
+                UPDATE messages SET read_at = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE recipient_id = ? AND message_id BETWEEN ? AND ? AND read_at IS NULL
+            ''', (user_id, min_id, max_id))
             conn.commit()
     
-    def get_user_messages(self, user_id):
+    # Методы для хранения состояния бота (user_data и диалоги), значения в JSON
+    def load_user_data(self, user_id):
         with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT m.*, u.first_name as sender_name 
-                FROM messages m
-                JOIN users u ON m.sender_id = u.user_id
-                WHERE m.recipient_id = ?
-                ORDER BY m.sent_at DESC
-            ''', (user_id,))
-            return cursor.fetchall()
\ No newline at end of file
+            rows = conn.execute('SELECT key, value FROM user_data WHERE user_id = ?', (user_id,)).fetchall()
+            return {row['key']: row['value'] for row in rows}
+    
+    def save_user_data(self, user_id, changed, removed):
+        with self._get_connection() as conn:
+            if changed:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO user_data (user_id, key, value) VALUES (?, ?, ?)',
+                    [(user_id, key, value) for key, value in changed.items()]
+                )
+            if removed:
+                conn.executemany(
+                    'DELETE FROM user_data WHERE user_id = ? AND key = ?',
+                    [(user_id, key) for key in removed]
+                )
+            conn.commit()
+    
+    def load_conversation_state(self, name, conversation_key):
+        with self._get_connection() as conn:
+            row = conn.execute(
+                'SELECT state FROM conversations WHERE name = ? AND conversation_key = ?',
+                (name, conversation_key)
+            ).fetchone()
+            return row['state'] if row else None
+    
+    def save_conversation_state(self, name, conversation_key, state):
+        with self._get_connection() as conn:
+            if state is None:
+                conn.execute(
+                    'DELETE FROM conversations WHERE name = ? AND conversation_key = ?',
+                    (name, conversation_key)
+                )
+            else:
+                conn.execute(
+                    'INSERT OR REPLACE INTO conversations (name, conversation_key, state) VALUES (?, ?, ?)',
+                    (name, conversation_key, state)
+                )
+            conn.commit()
+    
+    # Методы для работы с исходящими уведомлениями (outbox)
+    @staticmethod
+    def _enqueue_notifications(conn, notifications):
+        """Уведомления (chat_id, text, reply_markup JSON) в транзакции вызывающего метода"""
+        if notifications:
+            conn.executemany('''
+                INSERT INTO outbox (chat_id, text, reply_markup, next_attempt_ts, created_ts)
+                VALUES (?, ?, ?, 0, CAST(strftime('%s', 'now') AS INTEGER))
+            ''', notifications)
+    
+    def get_due_notifications(self, now, limit):
+        with self._get_connection() as conn:
+            return conn.execute('''
+                SELECT outbox_id, chat_id, text, reply_markup, attempts
+                FROM outbox
+                WHERE failed_ts IS NULL AND next_attempt_ts <= ?
+                ORDER BY next_attempt_ts, outbox_id
+                LIMIT ?
+            ''', (now, limit)).fetchall()
+    
+    def next_notification_ts(self):
+        with self._get_connection() as conn:
+            return conn.execute('SELECT MIN(next_attempt_ts) FROM outbox WHERE failed_ts IS NULL').fetchone()[0]
+    
+    def delete_notification(self, outbox_id):
+        with self._get_connection() as conn:
+            conn.execute('DELETE FROM outbox WHERE outbox_id = ?', (outbox_id,))
+            conn.commit()
+    
+    def reschedule_notification(self, outbox_id, next_attempt_ts, error, count_attempt=True):
+        with self._get_connection() as conn:
+            conn.execute('''
+                UPDATE outbox SET next_attempt_ts = ?, last_error = ?, attempts = attempts + ?
+                WHERE outbox_id = ?
+            ''', (next_attempt_ts, error, 1 if count_attempt else 0, outbox_id))
+            conn.commit()
+    
+    def fail_notification(self, outbox_id, error):
+        with self._get_connection() as conn:
+            conn.execute('''
+                UPDATE outbox SET failed_ts = CAST(strftime('%s', 'now') AS INTEGER), last_error = ?,
+                                  attempts = attempts + 1
+                WHERE outbox_id = ?
+            ''', (error, outbox_id))
+            conn.commit()
+
+_database = None
+_database_lock = threading.Lock()
+
+def get_database():
+    """Общий экземпляр Database. Создается при первом обращении, а не при импорте модулей"""
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database()
+    return _database
+
+# Время выполнения каждого публичного метода попадает в метрики (семейство db)
+instrument_class(Database, 'db')
\ No newline at end of file
@@ -0,0 +1,78 @@
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from metrics import timed_handler
+
+logger = logging.getLogger(__name__)
+
+class ExecutorBusy(Exception):
+    """Очередь пула заполнена и место не освободилось за отведенное время"""
+
+class BoundedExecutor:
+    """Пул потоков с ограниченной очередью: при переполнении submit ждет, а затем отказывает"""
+    
+    def __init__(self, name, max_workers, max_queue, submit_timeout=Config.EXECUTOR_SUBMIT_TIMEOUT):
+        self.name = name
+        self.submit_timeout = submit_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-executor')
+        # Одновременно в пуле (выполняются + ждут в очереди) не больше max_workers + max_queue задач
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+    
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            raise ExecutorBusy(f"Executor '{self.name}' is overloaded")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+    
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+# Отдельные пулы: медленная передача файлов не должна занимать потоки для работы с базой
+db_executor = BoundedExecutor('db', Config.DB_EXECUTOR_WORKERS, Config.DB_EXECUTOR_QUEUE)
+io_executor = BoundedExecutor('io', Config.IO_EXECUTOR_WORKERS, Config.IO_EXECUTOR_QUEUE)
+
+def shutdown_executors(wait=True):
+    db_executor.shutdown(wait=wait)
+    io_executor.shutdown(wait=wait)
+
+def offload(executor):
+    """Декоратор обработчика: выполняет его в executor и сразу освобождает поток диспетчера.
+    
+    Подходит только для обработчиков, результат которых не нужен диспетчеру
+    (не для состояний ConversationHandler).
+    """
+    def decorator(callback):
+        # Время обработчика замеряется здесь, в пуле, а не в потоке диспетчера
+        timed_callback = timed_handler(callback.__qualname__, callback)
+        
+        def run(update, context, *args):
+            try:
+                timed_callback(update, context, *args)
+            except Exception as e:
+                # Ошибки передаем зарегистрированным обработчикам ошибок, как и для обычных обработчиков
+                if context.dispatcher.error_handlers:
+                    context.dispatcher.dispatch_error(update, e)
+                else:
+                    logger.exception(f"Error in offloaded handler {callback.__name__}")
+        
+        @functools.wraps(callback)
+        def wrapper(update, context, *args):
+            try:
+                executor.submit(run, update, context, *args)
+            except ExecutorBusy:
+                logger.warning(f"{executor.name} executor is full, rejecting {callback.__name__}")
+                if update.callback_query:
+                    update.callback_query.answer("⏳ Бот перегружен, попробуйте через несколько секунд.")
+                elif update.effective_message:
+                    update.effective_message.reply_text("⏳ Бот перегружен, попробуйте через несколько секунд.")
+        
+        wrapper.offloaded = True
+        return wrapper
+    return decorator
\ No newline at end of file
@@ -0,0 +1,97 @@
+import csv
+import os
+import tempfile
+import time
+from datetime import datetime
+from config import Config
+from catalog import get_catalog
+from metrics import metrics
+
+try:
+    import openpyxl
+except ImportError:  # без openpyxl доступна только выгрузка в CSV
+    openpyxl = None
+
+FORMATS = ('csv', 'xlsx')
+
+HEADER = ('ID расчета', 'Дата', 'ID проекта', 'Адрес', 'Описание проекта', 'Работник',
+          'Материал', 'Площадь, м²', 'Толщина, мм', 'Количество', 'Ед. изм.')
+
+def _export_row(row, catalog, units):
+    material = row['material_type']
+    unit = units.get(material)
+    if unit is None:
+        unit = units[material] = catalog.unit(material)
+    date = datetime.fromtimestamp(row['calculation_ts']).strftime('%Y-%m-%d %H:%M') if row['calculation_ts'] else ''
+    worker = ' '.join(part for part in (row['first_name'], row['last_name']) if part)
+    return (row['calculation_id'], date, row['project_id'], row['address'] or '', row['description'] or '',
+            worker, material, row['area'], row['thickness'], row['quantity'], unit)
+
+def export_rows(db, project_id=None, since_ts=None, until_ts=None):
+    """Строки выгрузки расчетов: генератор, в памяти одновременно только одна пачка из базы"""
+    catalog = get_catalog()
+    units = {}
+    rows = db.iter_calculations_export(project_id, since_ts, until_ts)
+    # В метрику db идет только время выборки из базы, без записи файла между пачками
+    fetch_time = 0.0
+    error = False
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except Exception:
+                error = True
+                raise
+            finally:
+                fetch_time += time.perf_counter() - started
+            yield _export_row(row, catalog, units)
+    finally:
+        rows.close()
+        metrics.observe('db', 'iter_calculations_export', fetch_time, error)
+
+def _write_csv(file, rows):
+    # utf-8-sig и «;» - чтобы файл сразу открывался в русском Excel
+    writer = csv.writer(file, delimiter=';')
+    writer.writerow(HEADER)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+def _write_xlsx(path, rows):
+    # write_only: строки сразу пишутся во временный XML, а не накапливаются в памяти
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Расчеты')
+    sheet.append(HEADER)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+def export_calculations(db, fmt='csv', project_id=None, since_ts=None, until_ts=None):
+    """Выгружает расчеты во временный файл. Возвращает (путь, число строк); файл удаляет вызывающий"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'xlsx' and openpyxl is None:
+        raise RuntimeError("openpyxl is not installed")
+    
+    os.makedirs(Config.TEMP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='export_', suffix=f'.{fmt}', dir=Config.TEMP_DIR)
+    try:
+        rows = export_rows(db, project_id, since_ts, until_ts)
+        if fmt == 'csv':
+            with open(fd, 'w', encoding='utf-8-sig', newline='') as file:
+                count = _write_csv(file, rows)
+        else:
+            os.close(fd)
+            count = _write_xlsx(path, rows)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
\ No newline at end of file
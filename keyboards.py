@@ -1,52 +1,89 @@
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from config import Config
+from catalog import get_catalog
+from markup_cache import FrozenReplyKeyboardMarkup, FrozenInlineKeyboardMarkup, MarkupCache
+
+def _prebuilt(markup):
+    # Неизменяемая клавиатура: строится и сериализуется в JSON один раз при импорте
+    markup.to_json()
+    return markup
+
+_MAIN_MENUS = {
+    'admin': _prebuilt(FrozenReplyKeyboardMarkup([
+        ['📊 Калькулятор материалов'],
+        ['🏗 Проекты', '👥 Работники'],
+        ['📢 Рассылка', '📩 Сообщения']
+    ], resize_keyboard=True)),
+    'worker': _prebuilt(FrozenReplyKeyboardMarkup([
+        ['📊 Калькулятор материалов'],
+        ['🏗 Проекты', '📩 Сообщения']
+    ], resize_keyboard=True)),
+    'pending': _prebuilt(FrozenReplyKeyboardMarkup([['🚪 Запросить доступ']], resize_keyboard=True)),
+}
+
+_CONFIRM = _prebuilt(FrozenInlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Подтвердить", callback_data="confirm"),
+     InlineKeyboardButton("❌ Отменить", callback_data="cancel")]
+]))
+
+_WORKERS_MANAGEMENT = _prebuilt(FrozenInlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Заявки на доступ", callback_data="pending_workers")],
+    [InlineKeyboardButton("👷 Список работников", callback_data="workers_list")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="back")]
+]))
+
+_BROADCAST_CONFIRMATION = _prebuilt(FrozenInlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Отправить всем", callback_data="broadcast_confirm")],
+    [InlineKeyboardButton("✏️ Редактировать", callback_data="broadcast_edit")],
+    [InlineKeyboardButton("❌ Отменить", callback_data="broadcast_cancel")]
+]))
+
+_BACK = _prebuilt(FrozenReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True))
+
+# Клавиатуры с параметрами: карточка проекта и страницы списка проектов. Ключ кэша - все данные,
+# из которых строится клавиатура, поэтому после добавления проекта сбрасывать кэш не нужно:
+# новые страницы списка получают новые ключи, а неиспользуемые вытесняются
+_project_details = MarkupCache(Config.MARKUP_CACHE_SIZE)
+_project_pickers = MarkupCache(Config.MARKUP_CACHE_SIZE)
 
 class Keyboards:
     @staticmethod
     def main_menu(user_role):
-        if user_role == 'admin':
-            buttons = [
-                ['📊 Калькулятор материалов'],
-                ['🏗 Проекты', '👥 Работники'],
-                ['📢 Рассылка', '📩 Сообщения']
-            ]
-        elif user_role == 'worker':
-            buttons = [
-                ['📊 Калькулятор материалов'],
-                ['🏗 Проекты', '📩 Сообщения']
-            ]
-        else:
-            buttons = [['🚪 Запросить доступ']]
-        
-        return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
+        return _MAIN_MENUS.get(user_role, _MAIN_MENUS['pending'])
     
     @staticmethod
     def materials_keyboard():
-        materials = list(Config.MATERIALS.keys())
-        buttons = [materials[i:i+2] for i in range(0, len(materials), 2)]
-        buttons.append(['🔙 Назад'])
-        return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
+        # Клавиатура строится один раз при загрузке каталога
+        return get_catalog().keyboard
+    
+    @staticmethod
+    def project_picker_keyboard(projects, has_newer, has_older, can_add=False, action='project'):
+        # projects - страница списка выбора, новые сверху; action - префикс callback кнопки проекта
+        key = (tuple((project['project_id'], project['address']) for project in projects), has_newer, has_older, can_add, action)
+        return _project_pickers.get(key, lambda: Keyboards._build_project_picker(projects, has_newer, has_older, can_add, action))
     
     @staticmethod
-    def projects_keyboard(projects):
-        buttons = [[f"🏠 {project['address']}"] for project in projects]
-        buttons.append(['🔙 Назад'])
-        return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
+    def _build_project_picker(projects, has_newer, has_older, can_add, action):
+        buttons = [[InlineKeyboardButton(f"🏠 {project['address']}", callback_data=f"{action}_{project['project_id']}")]
+                   for project in projects]
+        navigation = []
+        if has_newer:
+            navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"projects_newer_{projects[0]['project_id']}"))
+        if has_older:
+            navigation.append(InlineKeyboardButton("Далее ➡️", callback_data=f"projects_older_{projects[-1]['project_id']}"))
+        if navigation:
+            buttons.append(navigation)
+        if can_add:
+            buttons.append([InlineKeyboardButton("➕ Добавить проект", callback_data="add_project")])
+        return FrozenInlineKeyboardMarkup(buttons) if buttons else None
     
     @staticmethod
     def confirm_keyboard():
-        return InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Подтвердить", callback_data="confirm"),
-             InlineKeyboardButton("❌ Отменить", callback_data="cancel")]
-        ])
+        return _CONFIRM
     
     @staticmethod
     def workers_management_keyboard():
-        return InlineKeyboardMarkup([
-            [InlineKeyboardButton("📝 Заявки на доступ", callback_data="pending_workers")],
-            [InlineKeyboardButton("👷 Список работников", callback_data="workers_list")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="back")]
-        ])
+        return _WORKERS_MANAGEMENT
     
     @staticmethod
     def worker_actions_keyboard(worker_id):
@@ -57,20 +94,41 @@ class Keyboards:
     
     @staticmethod
     def broadcast_confirmation_keyboard():
-        return InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Отправить всем", callback_data="broadcast_confirm")],
-            [InlineKeyboardButton("✏️ Редактировать", callback_data="broadcast_edit")],
-            [InlineKeyboardButton("❌ Отменить", callback_data="broadcast_cancel")]
-        ])
+        return _BROADCAST_CONFIRMATION
     
     @staticmethod
     def project_details_keyboard(project_id):
-        return InlineKeyboardMarkup([
+        return _project_details.get(project_id, lambda: FrozenInlineKeyboardMarkup([
             [InlineKeyboardButton("📝 Расчеты", callback_data=f"calculations_{project_id}")],
+            [InlineKeyboardButton("📦 Итого по проекту", callback_data=f"totals_{project_id}")],
             [InlineKeyboardButton("📄 Дизайн-проект", callback_data=f"design_{project_id}")],
             [InlineKeyboardButton("🔑 Код замка", callback_data=f"lock_{project_id}")]
-        ])
+        ]))
+    
+    @staticmethod
+    def calculations_page_keyboard(project_id, before_id=None, next_before_id=None):
+        buttons = []
+        if before_id is not None:
+            buttons.append(InlineKeyboardButton("⏮ В начало", callback_data=f"calculations_{project_id}"))
+        if next_before_id is not None:
+            buttons.append(InlineKeyboardButton("➡️ Далее", callback_data=f"calculations_{project_id}_{next_before_id}"))
+        return InlineKeyboardMarkup([buttons]) if buttons else None
+    
+    @staticmethod
+    def inbox_keyboard(messages, has_newer, has_older):
+        # messages - страница входящих, новые сверху
+        buttons = []
+        if has_newer:
+            buttons.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"inbox_newer_{messages[0]['message_id']}"))
+        if any(message['read_at'] is None for message in messages):
+            buttons.append(InlineKeyboardButton(
+                "✅ Прочитано",
+                callback_data=f"inbox_read_{messages[-1]['message_id']}_{messages[0]['message_id']}"
+            ))
+        if has_older:
+            buttons.append(InlineKeyboardButton("Старше ➡️", callback_data=f"inbox_older_{messages[-1]['message_id']}"))
+        return InlineKeyboardMarkup([buttons]) if buttons else None
     
     @staticmethod
     def back_keyboard():
-        return ReplyKeyboardMarkup([['🔙 Назад']], resize_keyboard=True)
\ No newline at end of file
+        return _BACK
\ No newline at end of file
@@ -0,0 +1,100 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import Config
+
+# Поля текущего обновления, которые попадают во все записи лога из этого потока
+_context = threading.local()
+
+@contextmanager
+def log_context(**fields):
+    previous = getattr(_context, 'fields', {})
+    _context.fields = {**previous, **fields}
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи update_id, user_id и handler из log_context"""
+    
+    def filter(self, record):
+        for key, value in getattr(_context, 'fields', {}).items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+    FIELDS = ('update_id', 'user_id', 'handler', 'duration_ms')
+    
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ContextQueueHandler(QueueHandler):
+    """Ставит запись в очередь; запись в файл выполняет фоновый поток QueueListener"""
+    
+    def prepare(self, record):
+        # Сообщение и трассировку готовим в потоке обработчика, а саму запись
+        # отдаем в очередь без ссылок на кадры стека и аргументы
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """Ротация по размеру со сжатием старых файлов в gzip (bot.log.1.gz, bot.log.2.gz, ...)"""
+    
+    def __init__(self, filename, max_bytes, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+    
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+def setup_logging(log_file=Config.LOG_FILE, level=Config.LOG_LEVEL):
+    """Настраивает логирование через очередь. Возвращает запущенный QueueListener"""
+    file_handler = CompressingRotatingFileHandler(log_file, Config.LOG_MAX_BYTES, Config.LOG_BACKUP_COUNT)
+    file_handler.setFormatter(JsonFormatter())
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
\ No newline at end of file
@@ -1,36 +1,72 @@
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, ConversationHandler
+import time
+# Время импорта модулей бота тоже входит в замер запуска
+_import_started = time.perf_counter()
+
+from telegram import Update
+from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters, ConversationHandler,
+                          TypeHandler, ContextTypes)
 from admin_handlers import AdminHandlers
 from worker_handlers import WorkerHandlers
 from shared_handlers import SharedHandlers
+from bot_context import BotContext
+from broadcast import BroadcastEngine
+from outbox import OutboxDispatcher
+from database import get_database
+from persistence import SQLitePersistence
+from executors import shutdown_executors
+from metrics import metrics, MetricsServer, instrument_bot, instrument_dispatcher
 from keyboards import Keyboards
+from router import MenuRouter
 from config import Config
 import logging
+import signal
+from catalog import get_catalog, reload_catalog
 from utils import ensure_temp_dir, cleanup_temp_files
+from logging_setup import setup_logging
+from webhook import run_webhook
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    filename=Config.LOG_FILE
-)
 logger = logging.getLogger(__name__)
 
-def main():
-    # Создаем временную директорию
-    ensure_temp_dir()
+def reload_on_signal(signum, frame):
+    try:
+        reload_catalog()
+    except Exception as e:
+        logger.error(f"Error reloading material catalog: {e}")
+
+def setup_dispatcher(dp):
+    """Регистрирует сервисы и обработчики; используется и ботом, и бенчмарком"""
+    # Один экземпляр Database на процесс, обработчики получают его через context.db
+    dp.bot_data['db'] = get_database()
+    
+    # Фоновая рассылка с ограничением скорости
+    dp.bot_data['broadcast_engine'] = BroadcastEngine(dp.bot)
+    # Уведомления из outbox, включая оставшиеся неотправленными с прошлого запуска
+    dp.bot_data['outbox'] = OutboxDispatcher(dp.bot, dp.bot_data['db'])
+    dp.bot_data['outbox'].start()
     
-    # Инициализация бота
-    updater = Updater(Config.BOT_TOKEN, use_context=True)
-    dp = updater.dispatcher
+    # Загрузка пользователя из базы один раз на обновление (до всех остальных обработчиков)
+    dp.add_handler(TypeHandler(Update, SharedHandlers.load_user), group=-1)
     
     # Обработчики команд
     dp.add_handler(CommandHandler("start", SharedHandlers.start))
     dp.add_handler(CommandHandler("help", SharedHandlers.help))
     dp.add_handler(CommandHandler("message", WorkerHandlers.send_message_to_admin))
+    dp.add_handler(CommandHandler("reload", AdminHandlers.reload_settings))
+    dp.add_handler(CommandHandler("stats", AdminHandlers.show_stats))
+    dp.add_handler(CommandHandler("rebuild", AdminHandlers.rebuild_totals))
+    dp.add_handler(CommandHandler("export", AdminHandlers.export_data))
+    
+    # Inline-кнопка «➕ Добавить проект» из списка проектов открывает тот же диалог. Она проходит через
+    # MenuRouter, а не CallbackQueryHandler: остальные состояния диалога - текстовые сообщения
+    add_project_router = MenuRouter()
+    add_project_router.add_callback('add', AdminHandlers.start_add_project, roles=['admin'])
     
     # ConversationHandler для администратора (добавление проекта)
     project_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(Filters.regex('^🏗 Проекты$'), AdminHandlers.start_add_project)],
+        entry_points=[
+            MessageHandler(Filters.text(['➕ Добавить проект']), AdminHandlers.start_add_project),
+            add_project_router
+        ],
         states={
             AdminHandlers.PROJECT_ADDRESS: [MessageHandler(Filters.text & ~Filters.command, AdminHandlers.get_project_address)],
             AdminHandlers.PROJECT_DESCRIPTION: [MessageHandler(Filters.text & ~Filters.command, AdminHandlers.get_project_description)],
@@ -39,25 +75,29 @@ def main():
         },
         fallbacks=[
             CommandHandler('cancel', SharedHandlers.cancel),
-            MessageHandler(Filters.regex('^🔙 Назад$'), AdminHandlers.cancel_project_creation)
-        ]
+            MessageHandler(Filters.text(['🔙 Назад']), AdminHandlers.cancel_project_creation)
+        ],
+        name='project_creation',
+        persistent=True
     )
     
     # ConversationHandler для рассылки
     broadcast_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(Filters.regex('^📢 Рассылка$'), AdminHandlers.start_broadcast)],
+        entry_points=[MessageHandler(Filters.text(['📢 Рассылка']), AdminHandlers.start_broadcast)],
         states={
             AdminHandlers.BROADCAST_MESSAGE: [MessageHandler(Filters.text & ~Filters.command, AdminHandlers.confirm_broadcast)]
         },
         fallbacks=[
             CommandHandler('cancel', SharedHandlers.cancel),
-            MessageHandler(Filters.regex('^🔙 Назад$'), AdminHandlers.cancel_broadcast)
-        ]
+            MessageHandler(Filters.text(['🔙 Назад']), AdminHandlers.cancel_broadcast)
+        ],
+        name='broadcast',
+        persistent=True
     )
     
     # ConversationHandler для калькулятора
     calc_conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(Filters.regex('^📊 Калькулятор материалов$'), WorkerHandlers.start_calculation)],
+        entry_points=[MessageHandler(Filters.text(['📊 Калькулятор материалов']), WorkerHandlers.start_calculation)],
         states={
             WorkerHandlers.MATERIAL_TYPE: [MessageHandler(Filters.text & ~Filters.command, WorkerHandlers.get_material_type)],
             WorkerHandlers.AREA: [MessageHandler(Filters.text & ~Filters.command, WorkerHandlers.get_area)],
@@ -65,47 +105,117 @@ def main():
         },
         fallbacks=[
             CommandHandler('cancel', SharedHandlers.cancel),
-            MessageHandler(Filters.regex('^🔙 Назад$'), WorkerHandlers.cancel_calculation)
-        ]
+            MessageHandler(Filters.text(['🔙 Назад']), WorkerHandlers.cancel_calculation)
+        ],
+        name='calculator',
+        persistent=True
     )
     
-    # Обработчики сообщений
-    dp.add_handler(MessageHandler(Filters.regex('^🚪 Запросить доступ$'), WorkerHandlers.request_access))
-    dp.add_handler(MessageHandler(Filters.regex('^👥 Работники$'), AdminHandlers.manage_workers))
-    dp.add_handler(MessageHandler(Filters.regex('^📩 Сообщения$'), WorkerHandlers.show_messages))
-    dp.add_handler(MessageHandler(Filters.regex('^🔙 Назад$'), SharedHandlers.back_to_menu))
-    
-    # Обработчики проектов
+    # Диалоги проверяются первыми: пока пользователь в диалоге, его сообщения обрабатывает диалог
     dp.add_handler(project_conv_handler)
-    dp.add_handler(MessageHandler(Filters.regex('^🏗 Проекты$'), WorkerHandlers.show_projects_list))
-    dp.add_handler(MessageHandler(Filters.regex('^🏠 .*'), WorkerHandlers.show_project_details))
-    dp.add_handler(MessageHandler(Filters.regex('^🏠 .*'), AdminHandlers.show_project_details))
-    
-    # Обработчики callback-запросов
-    dp.add_handler(CallbackQueryHandler(AdminHandlers.show_pending_workers, pattern='^pending_workers$'))
-    dp.add_handler(CallbackQueryHandler(AdminHandlers.show_workers_list, pattern='^workers_list$'))
-    dp.add_handler(CallbackQueryHandler(AdminHandlers.handle_worker_approval, pattern='^(approve|reject)_\d+$'))
-    dp.add_handler(CallbackQueryHandler(AdminHandlers.project_details_callback, pattern='^(design|lock|calculations)_\d+$'))
-    dp.add_handler(CallbackQueryHandler(WorkerHandlers.project_details_callback, pattern='^(design|lock|calculations)_\d+$'))
-    dp.add_handler(CallbackQueryHandler(AdminHandlers.send_broadcast, pattern='^broadcast_(confirm|edit|cancel)$'))
-    
-    # Добавление ConversationHandler
     dp.add_handler(broadcast_conv_handler)
     dp.add_handler(calc_conv_handler)
     
-    # Обработчик для привязки расчета к проекту
-    dp.add_handler(MessageHandler(Filters.regex('^🏠 .*'), WorkerHandlers.link_calculation_to_project))
+    # Кнопки меню: обработчик выбирается по тексту кнопки, роли и состоянию пользователя.
+    # Неизвестный текст возвращает в главное меню
+    router = MenuRouter(fallback=SharedHandlers.start)
+    router.add('🚪 Запросить доступ', WorkerHandlers.request_access)
+    router.add('👥 Работники', AdminHandlers.manage_workers)
+    router.add('📩 Сообщения', SharedHandlers.show_messages)
+    router.add('🔙 Назад', SharedHandlers.back_to_menu)
+    router.add('🏗 Проекты', AdminHandlers.show_projects_list, roles=['admin'])
+    router.add('🏗 Проекты', WorkerHandlers.show_projects_list, roles=['worker'])
+    
+    # Проект из списка выбора открывает карточку проекта, из списка после расчета (link_<id>) - привязывает расчет.
+    # Кнопки «🏠 адрес» - от прежней клавиатуры со всеми проектами, она может оставаться у пользователей
+    router.add_callback('link', WorkerHandlers.link_calculation_to_project, roles=['admin', 'worker'])
+    for add_route, key in ((router.add_callback, 'project'), (router.add_prefix, '🏠')):
+        add_route(key, AdminHandlers.show_project_details, roles=['admin'])
+        add_route(key, WorkerHandlers.show_project_details, roles=['worker'])
+    router.add_callback('projects', SharedHandlers.project_picker_callback, roles=['admin', 'worker'])
+    # Текст при открытом списке проектов - поисковый запрос
+    router.add_text(SharedHandlers.search_projects, roles=['admin', 'worker'], state='project_picker')
+    
+    # Inline-кнопки
+    router.add_callback('pending', AdminHandlers.show_pending_workers, roles=['admin'])
+    router.add_callback('workers', AdminHandlers.show_workers_list, roles=['admin'])
+    router.add_callback('approve', AdminHandlers.handle_worker_approval, roles=['admin'])
+    router.add_callback('reject', AdminHandlers.handle_worker_approval, roles=['admin'])
+    router.add_callback('broadcast', AdminHandlers.send_broadcast, roles=['admin'])
+    router.add_callback('inbox', SharedHandlers.inbox_callback, roles=['admin', 'worker'])
+    for action in ('design', 'lock', 'calculations', 'totals'):
+        router.add_callback(action, AdminHandlers.project_details_callback, roles=['admin'])
+        router.add_callback(action, WorkerHandlers.project_details_callback, roles=['worker'])
+    dp.add_handler(router)
+    
+    # Замер времени обработчиков и запросов к Telegram API
+    instrument_dispatcher(dp)
+    instrument_bot(dp.bot)
+
+def main():
+    metrics.startup['imports'] = time.perf_counter() - _import_started
+    
+    # Ошибка конфигурации webhook видна сразу, а не после открытия базы и запуска потоков
+    if Config.BOT_MODE == 'webhook' and not Config.WEBHOOK_URL:
+        raise SystemExit("BOT_MODE=webhook requires WEBHOOK_URL")
+    
+    # Логи пишутся в файл фоновым потоком, обработчики только ставят записи в очередь
+    with metrics.startup_phase('logging'):
+        log_listener = setup_logging()
+    
+    # Создаем временную директорию
+    ensure_temp_dir()
+    
+    # Каталог материалов загружается при старте и перечитывается по SIGHUP или /reload
+    with metrics.startup_phase('catalog'):
+        get_catalog()
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload_on_signal)
+    
+    # База открывается один раз: соединение, миграции, индекс адресов проектов
+    with metrics.startup_phase('database'):
+        db = get_database()
+    
+    # Инициализация бота: диалоги и user_data хранятся в базе и переживают перезапуск
+    with metrics.startup_phase('dispatcher'):
+        updater = Updater(
+            Config.BOT_TOKEN,
+            use_context=True,
+            context_types=ContextTypes(context=BotContext),
+            persistence=SQLitePersistence(db)
+        )
+        dp = updater.dispatcher
+        setup_dispatcher(dp)
+    
+    # Метрики для Prometheus на локальном адресе
+    metrics_server = None
+    if Config.METRICS_PORT:
+        with metrics.startup_phase('metrics_server'):
+            metrics_server = MetricsServer()
+            metrics_server.start()
     
-    # Обработчик неизвестных команд
-    dp.add_handler(MessageHandler(Filters.text, SharedHandlers.start))
+    # Запуск бота: webhook за обратным прокси или long polling
+    if Config.BOT_MODE == 'webhook':
+        logger.info(f"Бот запущен в режиме webhook. Запуск: {metrics.startup_summary()}")
+        run_webhook(updater)
+    else:
+        with metrics.startup_phase('polling'):
+            updater.start_polling()
+        logger.info(f"Бот запущен и работает. Запуск: {metrics.startup_summary()}")
+        updater.idle()
     
-    # Запуск бота
-    updater.start_polling()
-    logger.info("Бот запущен и работает...")
-    updater.idle()
+    # Дожидаемся завершения начатых рассылок
+    dp.bot_data['broadcast_engine'].shutdown(wait=True)
+    shutdown_executors(wait=True)
+    dp.bot_data['outbox'].shutdown()
+    # Отложенные записи расчетов и сообщений фиксируются до выхода
+    db.close()
+    if metrics_server:
+        metrics_server.shutdown()
     
     # Очистка временных файлов при завершении
     cleanup_temp_files()
+    log_listener.stop()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
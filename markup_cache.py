@@ -0,0 +1,46 @@
+import threading
+from collections import OrderedDict
+from telegram import InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+class _SerializedOnce:
+    """JSON клавиатуры строится при первой отправке и дальше переиспользуется.
+    
+    Bot вызывает to_json() у reply_markup при каждом запросе; для клавиатур,
+    которые не меняются после создания, результат всегда один и тот же.
+    """
+    __slots__ = ()
+    
+    def to_json(self):
+        try:
+            return self._json
+        except AttributeError:
+            self._json = super().to_json()
+            return self._json
+
+class FrozenReplyKeyboardMarkup(_SerializedOnce, ReplyKeyboardMarkup):
+    __slots__ = ('_json',)
+
+class FrozenInlineKeyboardMarkup(_SerializedOnce, InlineKeyboardMarkup):
+    __slots__ = ('_json',)
+
+class MarkupCache:
+    """Ограниченный LRU-кэш готовых клавиатур по ключу параметров"""
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, build):
+        with self._lock:
+            markup = self._items.get(key)
+            if markup is not None:
+                self._items.move_to_end(key)
+                return markup
+        # Клавиатура строится без блокировки: в худшем случае два потока построят одинаковую
+        markup = build()
+        with self._lock:
+            self._items[key] = markup
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return markup
\ No newline at end of file
@@ -0,0 +1,299 @@
+import functools
+import inspect
+from contextlib import contextmanager
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import Config
+from logging_setup import log_context
+
+logger = logging.getLogger(__name__)
+updates_logger = logging.getLogger('updates')
+
+# Границы корзин гистограмм в секундах (как принято в Prometheus)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Семейства метрик: имя в формате Prometheus, имя метки и описание
+FAMILIES = {
+    'handler': ('bot_handler', 'handler', 'Время выполнения обработчиков обновлений'),
+    'db': ('bot_db', 'method', 'Время выполнения методов Database'),
+    'api': ('bot_telegram_api', 'method', 'Время запросов к Telegram Bot API'),
+}
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами: память не растет с числом наблюдений"""
+    
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+    
+    def observe(self, seconds, error=False):
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        with self._lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if error:
+                self.errors += 1
+    
+    def snapshot(self):
+        with self._lock:
+            return list(self.buckets), self.count, self.sum, self.errors
+    
+    @staticmethod
+    def quantile(buckets, count, q):
+        """Оценка квантиля по корзинам с линейной интерполяцией внутри корзины"""
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(buckets):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-1]
+
+class Metrics:
+    """Реестр гистограмм по семействам (handler, db, api) и именам"""
+    
+    def __init__(self):
+        self._histograms = {family: {} for family in FAMILIES}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        # Длительность этапов запуска в секундах, в порядке выполнения
+        self.startup = {}
+    
+    def histogram(self, family, name):
+        histograms = self._histograms[family]
+        histogram = histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(name, Histogram())
+        return histogram
+    
+    def observe(self, family, name, seconds, error=False):
+        self.histogram(family, name).observe(seconds, error)
+    
+    def timed(self, family, name, fn):
+        """Оборачивает функцию замером времени; исключения считаются ошибками и пробрасываются дальше"""
+        histogram = self.histogram(family, name)
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            error = False
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, error)
+        
+        return wrapper
+    
+    @contextmanager
+    def startup_phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup[name] = time.perf_counter() - started
+    
+    def startup_summary(self):
+        phases = ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in self.startup.items())
+        return f"{phases}; всего {sum(self.startup.values()) * 1000:.0f} мс"
+    
+    def items(self, family):
+        with self._lock:
+            items = list(self._histograms[family].items())
+        return sorted(items)
+    
+    def render_prometheus(self):
+        lines = []
+        for family, (metric, label, description) in FAMILIES.items():
+            lines.append(f"# HELP {metric}_duration_seconds {description}")
+            lines.append(f"# TYPE {metric}_duration_seconds histogram")
+            errors = []
+            for name, histogram in self.items(family):
+                buckets, count, total, error_count = histogram.snapshot()
+                value = name.replace('\\', '\\\\').replace('"', '\\"')
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_duration_seconds_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_duration_seconds_bucket{{{label}="{value}",le="+Inf"}} {count}')
+                lines.append(f'{metric}_duration_seconds_sum{{{label}="{value}"}} {total:.6f}')
+                lines.append(f'{metric}_duration_seconds_count{{{label}="{value}"}} {count}')
+                errors.append(f'{metric}_errors_total{{{label}="{value}"}} {error_count}')
+            lines.append(f"# HELP {metric}_errors_total Число ошибок")
+            lines.append(f"# TYPE {metric}_errors_total counter")
+            lines.extend(errors)
+        lines.append("# HELP bot_startup_phase_seconds Длительность этапов запуска")
+        lines.append("# TYPE bot_startup_phase_seconds gauge")
+        for name, seconds in list(self.startup.items()):
+            lines.append(f'bot_startup_phase_seconds{{phase="{name}"}} {seconds:.6f}')
+        lines.append("# HELP bot_uptime_seconds Время работы бота")
+        lines.append("# TYPE bot_uptime_seconds gauge")
+        lines.append(f"bot_uptime_seconds {time.time() - self.started_at:.0f}")
+        return '\n'.join(lines) + '\n'
+    
+    def render_summary(self, limit=10):
+        """Краткая сводка для команды /stats: самые медленные по p95 в каждом семействе"""
+        titles = {'handler': '⚙️ Обработчики', 'db': '🗄 База данных', 'api': '📡 Telegram API'}
+        uptime = int(time.time() - self.started_at)
+        parts = [f"📈 Статистика за {uptime // 3600} ч {uptime % 3600 // 60} мин"]
+        if self.startup:
+            parts.append(f"🚀 Запуск: {self.startup_summary()}")
+        for family in FAMILIES:
+            rows = []
+            for name, histogram in self.items(family):
+                buckets, count, total, errors = histogram.snapshot()
+                if count:
+                    rows.append((Histogram.quantile(buckets, count, 0.95), name, count, total / count, errors))
+            if not rows:
+                continue
+            rows.sort(reverse=True)
+            lines = [f"{name}: {count} шт., ср. {avg * 1000:.1f} мс, p95 {p95 * 1000:.1f} мс"
+                     + (f", ошибок {errors}" if errors else "")
+                     for p95, name, count, avg, errors in rows[:limit]]
+            parts.append(f"{titles[family]}:\n" + "\n".join(lines))
+        return "\n\n".join(parts)
+
+metrics = Metrics()
+
+def timed_handler(name, callback):
+    """Обертка обработчика: замер времени, контекст обновления для лога и запись о выполнении"""
+    histogram = metrics.histogram('handler', name)
+    
+    @functools.wraps(callback)
+    def wrapper(update, context, *args):
+        user = getattr(update, 'effective_user', None)
+        with log_context(update_id=getattr(update, 'update_id', None), user_id=user.id if user else None, handler=name):
+            started = time.perf_counter()
+            error = False
+            try:
+                return callback(update, context, *args)
+            except Exception:
+                error = True
+                raise
+            finally:
+                duration = time.perf_counter() - started
+                histogram.observe(duration, error)
+                updates_logger.info("Handler failed" if error else "Handler finished",
+                                    extra={'duration_ms': round(duration * 1000, 2)})
+    
+    return wrapper
+
+def instrument_class(cls, family):
+    """Замер всех публичных методов класса (для Database).
+    
+    Генераторы пропускаются: вызов только создает генератор, а запросы выполняются
+    при переборе - такие методы замеряет вызывающий код.
+    """
+    for name, method in list(vars(cls).items()):
+        if not name.startswith('_') and callable(method) and not inspect.isgeneratorfunction(method):
+            setattr(cls, name, metrics.timed(family, name, method))
+
+def instrument_bot(bot):
+    """Замер запросов к Bot API: обертка над объектом Request бота"""
+    request = bot.request
+    if getattr(request, 'instrumented', False):
+        return
+    post = request.post
+    
+    def timed_post(url, data=None, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        error = False
+        try:
+            return post(url, data, timeout)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe('api', method, time.perf_counter() - started, error)
+    
+    request.post = timed_post
+    # Скачивание файлов идет мимо post
+    request.retrieve = metrics.timed('api', 'downloadFile', request.retrieve)
+    request.download = metrics.timed('api', 'downloadFile', request.download)
+    request.instrumented = True
+
+def walk_callbacks(dp, wrap):
+    """Заменяет колбэк каждого обработчика диспетчера на wrap(callback).
+    
+    Обходит и обработчики, вложенные в ConversationHandler и MenuRouter
+    (у Handler и Route колбэк одинаково хранится в атрибуте callback).
+    """
+    from telegram.ext import ConversationHandler
+    from router import MenuRouter
+    
+    def visit(handler):
+        if isinstance(handler, MenuRouter):
+            for route in handler.routes():
+                route.callback = wrap(route.callback)
+        elif isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + handler.fallbacks:
+                visit(nested)
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    visit(nested)
+        else:
+            handler.callback = wrap(handler.callback)
+    
+    for handlers in dp.handlers.values():
+        for handler in handlers:
+            visit(handler)
+
+def instrument_dispatcher(dp):
+    """Замер колбэков всех обработчиков, включая вложенные в ConversationHandler и MenuRouter.
+    
+    Обработчики с @offload замеряются в пуле, где они реально выполняются.
+    """
+    def wrap(callback):
+        if getattr(callback, 'offloaded', False):
+            return callback
+        return timed_handler(callback.__qualname__, callback)
+    
+    walk_callbacks(dp, wrap)
+
+class MetricsServer:
+    """Локальный HTTP-сервер с метриками в формате Prometheus (GET /metrics)"""
+    
+    def __init__(self, host=Config.METRICS_HOST, port=Config.METRICS_PORT):
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+        
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+        host, port = self.server.server_address[:2]
+        logger.info(f"Metrics endpoint: http://{host}:{port}/metrics")
+    
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
\ No newline at end of file
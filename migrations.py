@@ -0,0 +1,305 @@
+import logging
+import os
+import sqlite3
+from storage import blob_store
+
+logger = logging.getLogger(__name__)
+
+def _initial_schema(cursor):
+    # Таблица пользователей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            role TEXT CHECK(role IN ('admin', 'worker', 'pending')),
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Таблица проектов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            project_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            address TEXT NOT NULL,
+            description TEXT,
+            design_pdf_path TEXT,
+            lock_code TEXT,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users(user_id)
+        )
+    ''')
+    
+    # Таблица расчетов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS calculations (
+            calculation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            project_id INTEGER,
+            material_type TEXT,
+            area REAL,
+            thickness REAL,
+            quantity REAL,
+            calculation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id),
+            FOREIGN KEY (project_id) REFERENCES projects(project_id)
+        )
+    ''')
+    
+    # Таблица сообщений
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER,
+            recipient_id INTEGER,
+            text TEXT,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (sender_id) REFERENCES users(user_id),
+            FOREIGN KEY (recipient_id) REFERENCES users(user_id)
+        )
+    ''')
+
+def _projects_address_index(cursor):
+    # Уникальный индекс по адресу для поиска проекта по тексту кнопки
+    try:
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_projects_address ON projects(address)')
+    except sqlite3.IntegrityError:
+        # В базе уже есть проекты с одинаковыми адресами - обходимся обычным индексом
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_projects_address_lookup ON projects(address)')
+
+def _epoch_timestamps_and_indexes(cursor):
+    # Целочисленные метки времени (unix epoch) вместо сортировки по TEXT-датам
+    cursor.execute('ALTER TABLE users ADD COLUMN registration_ts INTEGER')
+    cursor.execute('ALTER TABLE projects ADD COLUMN created_ts INTEGER')
+    cursor.execute('ALTER TABLE calculations ADD COLUMN calculation_ts INTEGER')
+    cursor.execute('ALTER TABLE messages ADD COLUMN sent_ts INTEGER')
+    
+    # Заполняем метки для уже существующих строк
+    cursor.execute("UPDATE users SET registration_ts = CAST(strftime('%s', registration_date) AS INTEGER)")
+    cursor.execute("UPDATE projects SET created_ts = CAST(strftime('%s', created_at) AS INTEGER)")
+    cursor.execute("UPDATE calculations SET calculation_ts = CAST(strftime('%s', calculation_date) AS INTEGER)")
+    cursor.execute("UPDATE messages SET sent_ts = CAST(strftime('%s', sent_at) AS INTEGER)")
+    
+    # Индексы под основные запросы (rowid входит в каждый индекс, поэтому
+    # сортировка по первичному ключу внутри группы не требует временного B-дерева)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_projects_created_ts ON projects(created_ts)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_calculations_user_ts ON calculations(user_id, calculation_ts)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_calculations_project ON calculations(project_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_calculations_project_user ON calculations(project_id, user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_recipient_ts ON messages(recipient_id, sent_ts)')
+
+def _projects_design_file_id(cursor):
+    # file_id документа в Telegram: повторная отправка без загрузки файла
+    cursor.execute('ALTER TABLE projects ADD COLUMN design_file_id TEXT')
+
+def _projects_design_blob(cursor):
+    # Ссылка на файл дизайн-проекта в хранилище и исходное имя файла
+    cursor.execute('ALTER TABLE projects ADD COLUMN design_blob TEXT')
+    cursor.execute('ALTER TABLE projects ADD COLUMN design_file_name TEXT')
+    
+    # Переносим в хранилище файлы старых проектов, если они еще остались на диске
+    rows = cursor.execute('SELECT project_id, design_pdf_path FROM projects WHERE design_pdf_path IS NOT NULL').fetchall()
+    for project_id, design_pdf_path in rows:
+        if not os.path.isfile(design_pdf_path):
+            continue
+        digest = blob_store.put_file(design_pdf_path)
+        cursor.execute(
+            'UPDATE projects SET design_blob = ?, design_file_name = ?, design_pdf_path = ? WHERE project_id = ?',
+            (digest, os.path.basename(design_pdf_path), blob_store.path_for(digest), project_id)
+        )
+
+def _persistence_tables(cursor):
+    # Состояния диалогов и user_data: значения в JSON, одна строка на ключ,
+    # чтобы сохранять только изменившиеся ключи
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (user_id, key)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            name TEXT NOT NULL,
+            conversation_key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, conversation_key)
+        ) WITHOUT ROWID
+    ''')
+
+def _messages_read_at(cursor):
+    # Время прочтения сообщения (epoch), NULL - не прочитано
+    cursor.execute('ALTER TABLE messages ADD COLUMN read_at INTEGER')
+    # Страницы входящих листаются по message_id, непрочитанные считаются по частичному индексу
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_recipient_id ON messages(recipient_id, message_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages(recipient_id) WHERE read_at IS NULL')
+
+def _projects_fts(cursor):
+    # Полнотекстовый индекс по адресу и описанию проекта. Таблица с внешним
+    # содержимым: текст не дублируется, индекс поддерживают триггеры
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE projects_fts USING fts5(
+                address, description, content='projects', content_rowid='project_id'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite собран без FTS5 - поиск проектов работает через LIKE
+        logger.warning(f"FTS5 is not available, project search falls back to LIKE: {e}")
+        return
+    cursor.execute('''
+        CREATE TRIGGER projects_fts_insert AFTER INSERT ON projects BEGIN
+            INSERT INTO projects_fts (rowid, address, description)
+            VALUES (new.project_id, new.address, new.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER projects_fts_delete AFTER DELETE ON projects BEGIN
+            INSERT INTO projects_fts (projects_fts, rowid, address, description)
+            VALUES ('delete', old.project_id, old.address, old.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER projects_fts_update AFTER UPDATE OF address, description ON projects BEGIN
+            INSERT INTO projects_fts (projects_fts, rowid, address, description)
+            VALUES ('delete', old.project_id, old.address, old.description);
+            INSERT INTO projects_fts (rowid, address, description)
+            VALUES (new.project_id, new.address, new.description);
+        END
+    ''')
+    # Индексируем уже существующие проекты
+    cursor.execute("INSERT INTO projects_fts (projects_fts) VALUES ('rebuild')")
+
+def _project_material_totals(cursor):
+    # Итоги по материалам проекта: обновляются вместе с добавлением расчета,
+    # чтобы не суммировать строки calculations при каждом запросе
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS project_material_totals (
+            project_id INTEGER NOT NULL,
+            material_type TEXT NOT NULL,
+            quantity REAL NOT NULL,
+            area REAL NOT NULL,
+            calculations INTEGER NOT NULL,
+            PRIMARY KEY (project_id, material_type)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(PROJECT_TOTALS_BACKFILL)
+
+# Пересчет итогов по всем расчетам (миграция и команда /rebuild)
+PROJECT_TOTALS_BACKFILL = '''
+    INSERT INTO project_material_totals (project_id, material_type, quantity, area, calculations)
+    SELECT project_id, material_type, SUM(quantity), SUM(area), COUNT(*)
+    FROM calculations
+    WHERE project_id IS NOT NULL
+    GROUP BY project_id, material_type
+'''
+
+def _users_rejected_role(cursor):
+    # Роль 'rejected' для отклоненных заявок. CHECK нельзя изменить через ALTER TABLE,
+    # поэтому таблица пересоздается с переносом данных
+    cursor.execute('''
+        CREATE TABLE users_new (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            role TEXT CHECK(role IN ('admin', 'worker', 'pending', 'rejected')),
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            registration_ts INTEGER
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO users_new (user_id, username, first_name, last_name, role, registration_date, registration_ts)
+        SELECT user_id, username, first_name, last_name, role, registration_date, registration_ts FROM users
+    ''')
+    cursor.execute('DROP TABLE users')
+    cursor.execute('ALTER TABLE users_new RENAME TO users')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)')
+
+def _outbox(cursor):
+    # Исходящие уведомления: строка пишется в одной транзакции с изменением,
+    # о котором уведомляет, и удаляется после успешной отправки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_ts REAL NOT NULL,
+            created_ts INTEGER NOT NULL,
+            last_error TEXT,
+            failed_ts INTEGER
+        )
+    ''')
+    # Окончательно неотправленные (failed_ts) остаются в таблице для разбора и в выборку не попадают
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_ts) WHERE failed_ts IS NULL')
+
+def _drop_unused_indexes(cursor):
+    # Запросы по project_id обслуживает префикс idx_calculations_project_user, входящие листаются
+    # по idx_messages_recipient_id, а выборок расчетов и сообщений по времени не осталось -
+    # эти индексы только замедляли запись расчетов и сообщений
+    cursor.execute('DROP INDEX IF EXISTS idx_calculations_project')
+    cursor.execute('DROP INDEX IF EXISTS idx_calculations_user_ts')
+    cursor.execute('DROP INDEX IF EXISTS idx_messages_recipient_ts')
+
+# Упорядоченный список миграций: (версия, название, функция)
+# Уже примененные миграции не изменяются - новые добавляются в конец списка
+MIGRATIONS = [
+    (1, 'initial_schema', _initial_schema),
+    (2, 'projects_address_index', _projects_address_index),
+    (3, 'epoch_timestamps_and_indexes', _epoch_timestamps_and_indexes),
+    (4, 'projects_design_file_id', _projects_design_file_id),
+    (5, 'projects_design_blob', _projects_design_blob),
+    (6, 'persistence_tables', _persistence_tables),
+    (7, 'messages_read_at', _messages_read_at),
+    (8, 'projects_fts', _projects_fts),
+    (9, 'project_material_totals', _project_material_totals),
+    (10, 'users_rejected_role', _users_rejected_role),
+    (11, 'outbox', _outbox),
+    (12, 'drop_unused_indexes', _drop_unused_indexes),
+]
+
+def get_schema_version(conn):
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def apply_migrations(conn):
+    """Применяет к базе все миграции, которые еще не были применены"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+    
+    for version, name, migration in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+        
+        # Каждая миграция выполняется в своей транзакции вместе с записью версии
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Повторная проверка под блокировкой: миграцию мог применить другой процесс
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            
+            migration(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER))",
+                (version, name)
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            logger.exception(f"Migration {version} ({name}) failed")
+            raise
+        
+        logger.info(f"Applied migration {version} ({name})")
\ No newline at end of file
@@ -0,0 +1,83 @@
+import logging
+import random
+import threading
+import time
+from telegram.error import RetryAfter, BadRequest, Unauthorized, ChatMigrated
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def notification(chat_id, text, reply_markup=None):
+    """Уведомление для записи в outbox вместе с изменением в базе"""
+    return chat_id, text, reply_markup.to_json() if reply_markup else None
+
+class OutboxDispatcher:
+    """Фоновая отправка уведомлений из таблицы outbox с повторами.
+    
+    Строка удаляется только после успешной отправки, поэтому уведомление
+    переживает сетевые ошибки и перезапуск бота. Отправка - «хотя бы один раз»:
+    при падении между отправкой и удалением строки уведомление придет повторно.
+    """
+    
+    def __init__(self, bot, db, poll_interval=Config.OUTBOX_POLL_INTERVAL, batch_size=Config.OUTBOX_BATCH_SIZE,
+                 backoff_base=Config.OUTBOX_BACKOFF_BASE, backoff_max=Config.OUTBOX_BACKOFF_MAX):
+        self.bot = bot
+        self.db = db
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def wake(self):
+        """Новые строки в outbox: отправить сразу, не дожидаясь опроса"""
+        self._wakeup.set()
+    
+    def shutdown(self):
+        # Неотправленные строки остаются в базе до следующего запуска
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                rows = self.db.get_due_notifications(time.time(), self.batch_size)
+                for row in rows:
+                    if self._stop.is_set():
+                        return
+                    self._deliver(row)
+                if len(rows) == self.batch_size:
+                    continue
+                next_ts = self.db.next_notification_ts()
+            except Exception:
+                logger.exception("Outbox dispatcher error")
+                next_ts = None
+            timeout = self.poll_interval if next_ts is None else min(max(next_ts - time.time(), 0), self.poll_interval)
+            self._wakeup.wait(timeout)
+    
+    def _deliver(self, row):
+        outbox_id = row['outbox_id']
+        try:
+            self.bot.send_message(row['chat_id'], row['text'], reply_markup=row['reply_markup'])
+        except RetryAfter as e:
+            # Telegram сам говорит, сколько ждать - не считаем это попыткой
+            logger.warning(f"Flood control for outbox {outbox_id}, retry in {e.retry_after}s")
+            self.db.reschedule_notification(outbox_id, time.time() + e.retry_after, str(e), count_attempt=False)
+        except (BadRequest, Unauthorized, ChatMigrated) as e:
+            # Чат недоступен или сообщение некорректно - повтор не поможет
+            logger.error(f"Outbox notification {outbox_id} to {row['chat_id']} failed permanently: {e}")
+            self.db.fail_notification(outbox_id, str(e))
+        except Exception as e:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** row['attempts']) * random.uniform(0.5, 1.0)
+            logger.warning(f"Outbox notification {outbox_id} to {row['chat_id']} failed: {e}, retry in {delay:.0f}s")
+            self.db.reschedule_notification(outbox_id, time.time() + delay, str(e))
+        else:
+            self.db.delete_notification(outbox_id)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import json
+import logging
+import threading
+from collections import defaultdict
+from telegram.ext import BasePersistence
+
+logger = logging.getLogger(__name__)
+
+class LazyUserData(defaultdict):
+    """user_data всех пользователей: данные пользователя читаются из базы при первом обращении.
+    
+    default_factory получает user_id - так словарь переживает копирование
+    в BasePersistence.insert_bot без потери загрузчика.
+    """
+    
+    def __missing__(self, user_id):
+        data = self[user_id] = self.default_factory(user_id)
+        return data
+
+class LazyConversations(dict):
+    """Состояния одного ConversationHandler: ключ читается из базы при первом обращении"""
+    
+    def __init__(self, loader):
+        super().__init__()
+        self._loader = loader
+        # Ключи, для которых уже известно, что сохраненного состояния нет
+        self._absent = set()
+    
+    def _ensure(self, key):
+        if dict.__contains__(self, key) or key in self._absent:
+            return
+        state = self._loader(key)
+        if state is None:
+            self._absent.add(key)
+        else:
+            dict.__setitem__(self, key, state)
+    
+    def get(self, key, default=None):
+        self._ensure(key)
+        return dict.get(self, key, default)
+    
+    def __contains__(self, key):
+        self._ensure(key)
+        return dict.__contains__(self, key)
+    
+    def __getitem__(self, key):
+        self._ensure(key)
+        return dict.__getitem__(self, key)
+    
+    def __setitem__(self, key, value):
+        self._absent.discard(key)
+        dict.__setitem__(self, key, value)
+    
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._absent.add(key)
+
+class SQLitePersistence(BasePersistence):
+    """Хранение user_data и состояний диалогов в основной базе.
+    
+    После каждого обновления записываются только изменившиеся ключи user_data
+    этого пользователя, а не все состояние целиком, как в PicklePersistence.
+    chat_data и bot_data не сохраняются: в bot_data лежат сервисы процесса.
+    """
+    
+    def __init__(self, db):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.db = db
+        # Последние сохраненные значения (JSON) по пользователям - для поиска изменений
+        self._snapshots = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _conversation_key(key):
+        return json.dumps(list(key))
+    
+    def _load_user_data(self, user_id):
+        rows = self.db.load_user_data(user_id)
+        data = {}
+        for key, value in rows.items():
+            try:
+                data[key] = json.loads(value)
+            except ValueError:
+                logger.warning(f"Skipping unreadable user_data value {key!r} of user {user_id}")
+        with self._lock:
+            self._snapshots[user_id] = rows
+        return data
+    
+    def get_user_data(self):
+        return LazyUserData(self._load_user_data)
+    
+    def update_user_data(self, user_id, data):
+        with self._lock:
+            snapshot = self._snapshots.setdefault(user_id, {})
+            changed = {}
+            for key, value in data.items():
+                try:
+                    serialized = json.dumps(value, ensure_ascii=False)
+                except (TypeError, ValueError):
+                    logger.warning(f"user_data value {key!r} of user {user_id} is not JSON serializable, not saved")
+                    continue
+                if snapshot.get(key) != serialized:
+                    changed[str(key)] = serialized
+            removed = [key for key in snapshot if key not in data]
+            if not changed and not removed:
+                return
+            self.db.save_user_data(user_id, changed, removed)
+            snapshot.update(changed)
+            for key in removed:
+                del snapshot[key]
+    
+    def get_conversations(self, name):
+        def load(key):
+            state = self.db.load_conversation_state(name, self._conversation_key(key))
+            return json.loads(state) if state is not None else None
+        return LazyConversations(load)
+    
+    def update_conversation(self, name, key, new_state):
+        self.db.save_conversation_state(
+            name, self._conversation_key(key), json.dumps(new_state) if new_state is not None else None
+        )
+    
+    def get_chat_data(self):
+        return defaultdict(dict)
+    
+    def get_bot_data(self):
+        return {}
+    
+    def update_chat_data(self, chat_id, data):
+        pass
+    
+    def update_bot_data(self, data):
+        pass
\ No newline at end of file
@@ -0,0 +1,107 @@
+from telegram import Update
+from telegram.ext import Handler
+from config import Config
+
+def user_role(update: Update, context):
+    """Роль пользователя для выбора обработчика: администраторы определяются по ADMIN_IDS"""
+    user = update.effective_user
+    if user and user.id in Config.ADMIN_IDS:
+        return 'admin'
+    user_row = getattr(context, 'user_row', None)
+    return user_row['role'] if user_row else 'pending'
+
+class Route:
+    """Обработчик кнопки с условиями: роли пользователя и ключ в user_data (состояние)"""
+    __slots__ = ('callback', 'roles', 'state')
+    
+    def __init__(self, callback, roles=None, state=None):
+        self.callback = callback
+        self.roles = frozenset(roles) if roles else None
+        self.state = state
+    
+    def matches(self, role, user_data):
+        if self.roles is not None and role not in self.roles:
+            return False
+        return self.state is None or self.state in user_data
+
+class MenuRouter(Handler):
+    """Маршрутизатор кнопок меню и inline-кнопок.
+    
+    Текст кнопки меню ищется в словаре целиком, динамические кнопки («🏠 адрес»)
+    и callback-данные («design_15») - по префиксу до первого разделителя. Любой
+    другой текст получают обработчики произвольного текста (например, поиск
+    в списке проектов), а если ни один не подошел - fallback. Среди
+    обработчиков одной кнопки выбирается первый подходящий по роли и состоянию,
+    поэтому порядок регистрации в main.py больше не влияет на результат.
+    """
+    
+    def __init__(self, fallback=None):
+        super().__init__(self._dispatch)
+        self.fallback = Route(fallback) if fallback else None
+        self.labels = {}
+        self.prefixes = {}
+        self.callbacks = {}
+        self.texts = []
+    
+    @staticmethod
+    def _add(table, key, callback, roles, state):
+        routes = table.setdefault(key, [])
+        routes.append(Route(callback, roles, state))
+        # Обработчики, зависящие от состояния, проверяются раньше общих
+        routes.sort(key=lambda route: route.state is None)
+    
+    def add(self, label, callback, roles=None, state=None):
+        """Кнопка меню с фиксированным текстом"""
+        self._add(self.labels, label, callback, roles, state)
+    
+    def add_prefix(self, prefix, callback, roles=None, state=None):
+        """Динамическая кнопка «<префикс> <текст>»"""
+        self._add(self.prefixes, prefix, callback, roles, state)
+    
+    def add_callback(self, prefix, callback, roles=None, state=None):
+        """Inline-кнопка с callback_data вида «<префикс>» или «<префикс>_<параметры>»"""
+        self._add(self.callbacks, prefix, callback, roles, state)
+    
+    def add_text(self, callback, roles=None, state=None):
+        """Произвольный текст, не совпавший ни с одной кнопкой"""
+        self.texts.append(Route(callback, roles, state))
+        self.texts.sort(key=lambda route: route.state is None)
+    
+    def routes(self):
+        for table in (self.labels, self.prefixes, self.callbacks):
+            for routes in table.values():
+                yield from routes
+        yield from self.texts
+        if self.fallback:
+            yield self.fallback
+    
+    def check_update(self, update):
+        if not isinstance(update, Update):
+            return None
+        
+        if update.callback_query:
+            data = update.callback_query.data
+            return self.callbacks.get(data.partition('_')[0]) if data else None
+        
+        if update.message and update.message.text:
+            text = update.message.text
+            routes = self.labels.get(text) or self.prefixes.get(text.partition(' ')[0])
+            if routes:
+                return routes
+            routes = self.texts + [self.fallback] if self.fallback else self.texts
+            return routes or None
+        return None
+    
+    def collect_additional_context(self, context, update, dispatcher, check_result):
+        context.routes = check_result
+    
+    def _dispatch(self, update: Update, context):
+        role = user_role(update, context)
+        for route in context.routes:
+            if route.matches(role, context.user_data):
+                return route.callback(update, context)
+        # Кнопка недоступна для роли - показываем меню, как для неизвестного текста
+        if self.fallback and update.message:
+            return self.fallback.callback(update, context)
+        if update.callback_query:
+            update.callback_query.answer("⛔ Нет доступа")
\ No newline at end of file
@@ -1,22 +1,36 @@
 from telegram import Update
-from telegram.ext import CallbackContext
-from database import Database
+from telegram.error import BadRequest
+from telegram.ext import CallbackContext, ConversationHandler
 from keyboards import Keyboards
+from catalog import get_catalog
+from config import Config
+from executors import offload, db_executor
+from datetime import datetime
+import os
+import logging
 
-db = Database()
+logger = logging.getLogger(__name__)
 
 class SharedHandlers:
+    @staticmethod
+    def load_user(update: Update, context: CallbackContext):
+        # Предобработчик: загружает пользователя один раз на обновление
+        if update.effective_user:
+            context.user_row = context.db.get_user(update.effective_user.id)
+    
     @staticmethod
     def start(update: Update, context: CallbackContext):
         user = update.effective_user
-        user_data = db.get_user(user.id)
+        user_data = context.user_row
         
         if not user_data:
-            db.add_user(user.id, user.username, user.first_name, user.last_name)
-            user_data = db.get_user(user.id)
+            context.db.add_user(user.id, user.username, user.first_name, user.last_name)
+            user_data = context.user_row = context.db.get_user(user.id)
         
         if user.id in Config.ADMIN_IDS:
-            db.update_user_role(user.id, 'admin')
+            if user_data['role'] != 'admin':
+                context.db.update_user_role(user.id, 'admin')
+                context.user_row = context.db.get_user(user.id)
             role = 'admin'
         else:
             role = user_data['role'] if user_data else 'pending'
@@ -38,7 +52,11 @@ class SharedHandlers:
             "ℹ️ Список доступных команд:\n\n"
             "/start - Главное меню\n"
             "/help - Эта справка\n"
-            "/message [текст] - Отправить сообщение администратору (для работников)\n\n"
+            "/message [текст] - Отправить сообщение администратору (для работников)\n"
+            "/reload - Перечитать каталог материалов и список администраторов (для администраторов)\n"
+            "/stats - Время работы обработчиков, базы и Telegram API (для администраторов)\n"
+            "/rebuild - Пересчитать итоги по материалам проектов (для администраторов)\n"
+            "/export [csv|xlsx] [project=ID] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] - Выгрузить расчеты (для администраторов)\n\n"
             "📊 Калькулятор материалов - расчет необходимого количества материалов\n"
             "🏗 Проекты - просмотр текущих проектов\n"
             "👥 Работники - управление доступом (для администраторов)\n"
@@ -50,8 +68,7 @@ class SharedHandlers:
     
     @staticmethod
     def cancel(update: Update, context: CallbackContext):
-        user = update.effective_user
-        user_data = db.get_user(user.id)
+        user_data = context.user_row
         role = user_data['role'] if user_data else 'pending'
         
         update.message.reply_text(
@@ -63,12 +80,191 @@ class SharedHandlers:
     
     @staticmethod
     def back_to_menu(update: Update, context: CallbackContext):
-        user = update.effective_user
-        user_data = db.get_user(user.id)
+        user_data = context.user_row
         role = user_data['role'] if user_data else 'pending'
         
         update.message.reply_text(
             "🏠 Главное меню",
             reply_markup=Keyboards.main_menu(role)
         )
-        context.user_data.clear()
\ No newline at end of file
+        context.user_data.clear()
+    
+    @staticmethod
+    def send_project_design(context: CallbackContext, chat_id, project):
+        caption = f"📄 Дизайн-проект для {project['address']}"
+        
+        # Файл уже есть на серверах Telegram - отправляем по file_id без загрузки
+        if project['design_file_id']:
+            try:
+                context.bot.send_document(chat_id=chat_id, document=project['design_file_id'], caption=caption)
+                return
+            except BadRequest as e:
+                logger.warning(f"Cached file_id for project {project['project_id']} rejected: {e}")
+        
+        with open(project['design_pdf_path'], 'rb') as file:
+            message = context.bot.send_document(
+                chat_id=chat_id,
+                document=file,
+                filename=project['design_file_name'] or os.path.basename(project['design_pdf_path']),
+                caption=caption
+            )
+        context.db.set_project_design_file_id(project['project_id'], message.document.file_id)
+    
+    @staticmethod
+    def project_totals_text(context: CallbackContext, project):
+        """Итого по проекту: количество и площадь по каждому материалу из таблицы итогов"""
+        totals = context.db.get_project_totals(project['project_id'])
+        if not totals:
+            return f"📭 Нет расчетов для проекта {project['address']}."
+        catalog = get_catalog()
+        lines = [f"🧱 {t['material_type']} - {round(t['quantity'], 2)} {catalog.unit(t['material_type'])} "
+                 f"(Площадь: {round(t['area'], 2)} м², расчетов: {t['calculations']})"
+                 for t in totals]
+        return f"📦 Итого по проекту {project['address']}:\n\n" + "\n".join(lines)
+    
+    @staticmethod
+    def _render_inbox(context: CallbackContext, user_id, messages, has_newer, has_older):
+        unread = context.db.count_unread_messages(user_id)
+        lines = [f"📩 Сообщения (непрочитанных: {unread})"]
+        for msg in messages:
+            text = msg['text']
+            if len(text) > Config.INBOX_PREVIEW_LENGTH:
+                text = text[:Config.INBOX_PREVIEW_LENGTH] + '…'
+            sent = datetime.fromtimestamp(msg['sent_ts']).strftime('%d.%m.%Y %H:%M') if msg['sent_ts'] else ''
+            marker = '🆕 ' if msg['read_at'] is None else ''
+            lines.append(f"{marker}От {msg['sender_name']}, {sent}:\n{text}")
+        return "\n\n".join(lines), Keyboards.inbox_keyboard(messages, has_newer, has_older)
+    
+    @staticmethod
+    @offload(db_executor)
+    def show_messages(update: Update, context: CallbackContext):
+        user = update.effective_user
+        page_size = Config.INBOX_PAGE_SIZE
+        messages = context.db.get_inbox_page(user.id, limit=page_size + 1)
+        
+        if not messages:
+            update.message.reply_text("📭 У вас нет сообщений.")
+            return
+        
+        has_older = len(messages) > page_size
+        text, keyboard = SharedHandlers._render_inbox(context, user.id, messages[:page_size], False, has_older)
+        update.message.reply_text(text, reply_markup=keyboard)
+    
+    @staticmethod
+    @offload(db_executor)
+    def inbox_callback(update: Update, context: CallbackContext):
+        """Листание входящих и отметка прочтения: сообщение со списком редактируется на месте"""
+        query = update.callback_query
+        user = update.effective_user
+        page_size = Config.INBOX_PAGE_SIZE
+        
+        parts = query.data.split('_')
+        action = parts[1]
+        if action == 'read':
+            min_id, max_id = int(parts[2]), int(parts[3])
+            context.db.mark_messages_read(user.id, min_id, max_id)
+            query.answer("✅ Отмечено как прочитанное")
+            messages = context.db.get_inbox_page(user.id, before_id=max_id + 1, limit=page_size)
+        elif action == 'newer':
+            query.answer()
+            messages = context.db.get_inbox_page(user.id, after_id=int(parts[2]), limit=page_size)
+        else:
+            query.answer()
+            messages = context.db.get_inbox_page(user.id, before_id=int(parts[2]), limit=page_size)
+        
+        if not messages:
+            query.edit_message_text("📭 У вас нет сообщений.")
+            return
+        
+        has_newer = context.db.has_inbox_messages(user.id, after_id=messages[0]['message_id'])
+        has_older = context.db.has_inbox_messages(user.id, before_id=messages[-1]['message_id'])
+        text, keyboard = SharedHandlers._render_inbox(context, user.id, messages, has_newer, has_older)
+        try:
+            query.edit_message_text(text, reply_markup=keyboard)
+        except BadRequest as e:
+            # Повторное нажатие на ту же кнопку: содержимое не изменилось
+            if 'not modified' not in str(e):
+                raise
+    
+    @staticmethod
+    def _render_project_picker(picker, projects, has_newer, has_older):
+        lines = [picker['title']]
+        if picker['query']:
+            lines.append(f"🔍 Поиск: «{picker['query']}»")
+        if not projects:
+            lines.append("📭 Проекты не найдены." if picker['query'] else "📭 Нет добавленных проектов.")
+        lines.append("✏️ Отправьте часть адреса, чтобы найти проект.")
+        keyboard = Keyboards.project_picker_keyboard(projects, has_newer, has_older, picker['can_add'],
+                                                     picker.get('action', 'project'))
+        return "\n".join(lines), keyboard
+    
+    @staticmethod
+    @offload(db_executor)
+    def _reply_project_picker(update: Update, context: CallbackContext, picker):
+        page_size = Config.PROJECTS_PAGE_SIZE
+        projects = context.db.search_projects(picker['query'], limit=page_size + 1)
+        has_older = len(projects) > page_size
+        text, keyboard = SharedHandlers._render_project_picker(picker, projects[:page_size], False, has_older)
+        update.effective_message.reply_text(text, reply_markup=keyboard)
+    
+    @staticmethod
+    def send_project_picker(update: Update, context: CallbackContext, title, can_add=False, action='project'):
+        """Список выбора проекта: по странице за раз, текст от пользователя сужает список.
+        
+        Пока в user_data есть project_picker, любой текст вне меню считается поисковым запросом.
+        Кнопка проекта присылает callback «<action>_<id>»: project - карточка проекта, link - привязка расчета.
+        Состояние списка меняется в потоке диспетчера - следующее обновление пользователя уже его видит;
+        в пул уходят только запрос к базе и ответ, с копией состояния.
+        """
+        picker = context.user_data['project_picker'] = {'title': title, 'query': '', 'can_add': can_add, 'action': action}
+        SharedHandlers._reply_project_picker(update, context, dict(picker))
+    
+    @staticmethod
+    def search_projects(update: Update, context: CallbackContext):
+        picker = context.user_data['project_picker']
+        picker['query'] = update.message.text.strip()[:100]
+        SharedHandlers._reply_project_picker(update, context, dict(picker))
+    
+    @staticmethod
+    def project_picker_callback(update: Update, context: CallbackContext):
+        """Листание списка проектов: сообщение со списком редактируется на месте"""
+        # Список мог остаться в чате после выхода в меню - листаем его без поиска
+        picker = context.user_data.get('project_picker') or {'title': "🏗 Выберите проект:", 'query': '', 'can_add': False,
+                                                             'action': 'project'}
+        SharedHandlers._page_project_picker(update, context, dict(picker))
+    
+    @staticmethod
+    @offload(db_executor)
+    def _page_project_picker(update: Update, context: CallbackContext, picker):
+        query = update.callback_query
+        query.answer()
+        page_size = Config.PROJECTS_PAGE_SIZE
+        
+        parts = query.data.split('_')
+        if parts[1] == 'newer':
+            projects = context.db.search_projects(picker['query'], after_id=int(parts[2]), limit=page_size)
+        else:
+            projects = context.db.search_projects(picker['query'], before_id=int(parts[2]), limit=page_size)
+        
+        has_newer = bool(projects) and context.db.has_projects(picker['query'], after_id=projects[0]['project_id'])
+        has_older = bool(projects) and context.db.has_projects(picker['query'], before_id=projects[-1]['project_id'])
+        text, keyboard = SharedHandlers._render_project_picker(picker, projects, has_newer, has_older)
+        try:
+            query.edit_message_text(text, reply_markup=keyboard)
+        except BadRequest as e:
+            if 'not modified' not in str(e):
+                raise
+    
+    @staticmethod
+    def close_project_picker(context: CallbackContext):
+        """Проект выбран - текст пользователя больше не считается поиском (вызывать в потоке диспетчера)"""
+        context.user_data.pop('project_picker', None)
+    
+    @staticmethod
+    def selected_project(update: Update, context: CallbackContext):
+        """Проект, выбранный в списке (callback project_<id> или link_<id>) или кнопкой «🏠 адрес» старой клавиатуры"""
+        query = update.callback_query
+        if query:
+            query.answer()
+            return context.db.get_project_with_creator(int(query.data.split('_')[1]))
+        return context.db.get_project_by_address(update.message.text[2:])  # Убираем эмодзи
\ No newline at end of file
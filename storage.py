@@ -0,0 +1,91 @@
+import hashlib
+import os
+import tempfile
+import time
+import urllib.request
+from config import Config
+from metrics import metrics
+
+CHUNK_SIZE = 64 * 1024
+
+class BlobStore:
+    """Хранилище файлов по SHA-256 содержимого: одинаковые файлы хранятся один раз"""
+    
+    def __init__(self, root=Config.STORAGE_DIR, suffix='.pdf'):
+        self.root = root
+        self.suffix = suffix
+    
+    def path_for(self, digest):
+        # Двухуровневая раскладка, чтобы не держать тысячи файлов в одном каталоге
+        return os.path.join(self.root, digest[:2], digest + self.suffix)
+    
+    def exists(self, digest):
+        return os.path.isfile(self.path_for(digest))
+    
+    def put_stream(self, source):
+        """Сохраняет поток в хранилище, вычисляя хэш на лету. Возвращает SHA-256"""
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        
+        sha256 = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    tmp.write(chunk)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            
+            digest = sha256.hexdigest()
+            path = self.path_for(digest)
+            if os.path.isfile(path):
+                # Такой файл уже загружали - оставляем существующую копию
+                os.unlink(tmp_path)
+                return digest
+            
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            self._fsync_dir(os.path.dirname(path))
+            return digest
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    
+    def put_file(self, file_path):
+        with open(file_path, 'rb') as source:
+            return self.put_stream(source)
+    
+    def put_telegram_file(self, file, timeout=Config.DESIGN_DOWNLOAD_TIMEOUT):
+        """Скачивает telegram.File потоком прямо в хранилище"""
+        # Локальный Bot API сервер отдает путь к файлу на диске
+        if file.file_path and os.path.isfile(file.file_path):
+            return self.put_file(file.file_path)
+        
+        started = time.perf_counter()
+        error = False
+        try:
+            with urllib.request.urlopen(file.file_path, timeout=timeout) as response:
+                return self.put_stream(response)
+        except Exception:
+            error = True
+            raise
+        finally:
+            # Скачивание идет мимо Bot.request, поэтому замеряем его здесь
+            metrics.observe('api', 'downloadFile', time.perf_counter() - started, error)
+    
+    @staticmethod
+    def _fsync_dir(path):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+blob_store = BlobStore()
\ No newline at end of file
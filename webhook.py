@@ -0,0 +1,111 @@
+import hmac
+import json
+import logging
+import secrets
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram import Update
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Обновления Telegram не бывают больше нескольких десятков КБ
+MAX_BODY_SIZE = 1024 * 1024
+
+class WebhookServer:
+    """Прием обновлений от Telegram по HTTP.
+    
+    Запрос проверяется по секретному токену, обновление кладется в очередь
+    диспетчера, и Telegram сразу получает ответ 200 - не дожидаясь обработчиков.
+    TLS завершается на обратном прокси, сервер слушает локальный адрес.
+    """
+    
+    def __init__(self, bot, update_queue, secret, host=Config.WEBHOOK_LISTEN, port=Config.WEBHOOK_PORT,
+                 path=Config.WEBHOOK_PATH):
+        secret = secret.encode('utf-8')
+        
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.split('?')[0] != path:
+                    self.send_error(404)
+                    return
+                if not hmac.compare_digest(self.headers.get(SECRET_HEADER, '').encode('utf-8'), secret):
+                    logger.warning(f"Webhook request with invalid secret token from {self.client_address[0]}")
+                    self.send_error(403)
+                    return
+                
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0 or length > MAX_BODY_SIZE:
+                    self.send_error(413 if length > MAX_BODY_SIZE else 400)
+                    return
+                try:
+                    update = Update.de_json(json.loads(self.rfile.read(length)), bot)
+                except (ValueError, TypeError, KeyError) as e:
+                    logger.warning(f"Invalid webhook payload: {e}")
+                    self.send_error(400)
+                    return
+                
+                update_queue.put(update)
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+        
+        self.path = path
+        self.server = ThreadingHTTPServer((host, port), WebhookRequestHandler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='webhook-server', daemon=True)
+    
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{self.path}"
+    
+    def start(self):
+        self._thread.start()
+        logger.info(f"Webhook listener: {self.url}")
+    
+    def shutdown(self):
+        # shutdown() ждет выхода из serve_forever и зависнет, если сервер не был запущен
+        if self._thread.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
+
+def run_webhook(updater):
+    """Запускает бота в режиме webhook и блокируется до SIGINT/SIGTERM"""
+    dp = updater.dispatcher
+    # Без заданного секрета генерируем новый при каждом запуске - он передается в setWebhook
+    secret = Config.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    
+    server = WebhookServer(updater.bot, dp.update_queue, secret)
+    ready = threading.Event()
+    dispatcher_thread = threading.Thread(target=dp.start, kwargs={'ready': ready}, name='dispatcher')
+    dispatcher_thread.start()
+    try:
+        ready.wait()
+        server.start()
+        
+        updater.bot.set_webhook(
+            url=Config.WEBHOOK_URL,
+            max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+            api_kwargs={'secret_token': secret}
+        )
+        
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: stop.set())
+        stop.wait()
+    finally:
+        # Останавливаем потоки и при ошибке запуска (например, setWebhook), иначе процесс не завершится.
+        # Webhook не удаляем: пока бот перезапускается, Telegram копит обновления у себя
+        logger.info("Stopping webhook listener")
+        server.shutdown()
+        dp.stop()
+        dispatcher_thread.join()
+        if dp.persistence:
+            dp.persistence.flush()
\ No newline at end of file
@@ -1,23 +1,27 @@
 from telegram import Update
 from telegram.ext import CallbackContext, ConversationHandler, MessageHandler, Filters
-from database import Database
 from keyboards import Keyboards
+from shared_handlers import SharedHandlers
+from config import Config
 from calculations import MaterialCalculator
+from catalog import get_catalog
+from executors import offload, db_executor, io_executor
+from outbox import notification
 import logging
 
 # Состояния для калькулятора
 MATERIAL_TYPE, AREA, THICKNESS = range(3)
 
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-db = Database()
-
 class WorkerHandlers:
+    # Состояния диалога (используются при регистрации в main.py)
+    MATERIAL_TYPE, AREA, THICKNESS = MATERIAL_TYPE, AREA, THICKNESS
+    
     @staticmethod
     def request_access(update: Update, context: CallbackContext):
         user = update.effective_user
-        user_data = db.get_user(user.id)
+        user_data = context.user_row
         
         if user_data and user_data['role'] != 'pending':
             update.message.reply_text(
@@ -25,18 +29,12 @@ class WorkerHandlers:
             )
             return
         
-        db.add_user(user.id, user.username, user.first_name, user.last_name, 'pending')
-        
-        # Уведомление администраторов
-        for admin_id in Config.ADMIN_IDS:
-            try:
-                context.bot.send_message(
-                    admin_id,
-                    f"🆕 Новый запрос на доступ:\n\n👤 {user.first_name} {user.last_name}\n📧 @{user.username}\n🆔 {user.id}",
-                    reply_markup=Keyboards.worker_actions_keyboard(user.id)
-                )
-            except Exception as e:
-                logger.error(f"Error notifying admin {admin_id}: {e}")
+        # Уведомления администраторов записываются в outbox вместе с заявкой
+        text = f"🆕 Новый запрос на доступ:\n\n👤 {user.first_name} {user.last_name}\n📧 @{user.username}\n🆔 {user.id}"
+        notifications = [notification(admin_id, text, Keyboards.worker_actions_keyboard(user.id))
+                         for admin_id in Config.ADMIN_IDS]
+        context.db.add_user(user.id, user.username, user.first_name, user.last_name, 'pending', notifications)
+        context.bot_data['outbox'].wake()
         
         update.message.reply_text(
             "✅ Ваш запрос на доступ отправлен администратору. Ожидайте подтверждения."
@@ -52,12 +50,12 @@ class WorkerHandlers:
     
     @staticmethod
     def get_material_type(update: Update, context: CallbackContext):
-        material = update.message.text.lower()
-        if material not in Config.MATERIALS:
+        material = get_catalog().get(update.message.text)
+        if not material:
             update.message.reply_text("❌ Пожалуйста, выберите материал из списка.")
             return MATERIAL_TYPE
         
-        context.user_data['material_type'] = material
+        context.user_data['material_type'] = material.name
         update.message.reply_text("📏 Введите площадь в м²:")
         return AREA
     
@@ -73,8 +71,8 @@ class WorkerHandlers:
         
         context.user_data['area'] = area
         
-        material = Config.MATERIALS[context.user_data['material_type']]
-        if material['thickness_dependent']:
+        material = get_catalog().get(context.user_data['material_type'])
+        if material and material.thickness_dependent:
             update.message.reply_text("📐 Введите толщину слоя в мм:")
             return THICKNESS
         else:
@@ -102,47 +100,58 @@ class WorkerHandlers:
         quantity = MaterialCalculator.calculate_material(material_type, area, thickness)
         result = MaterialCalculator.format_calculation_result(material_type, area, thickness, quantity)
         
-        # Сохранение расчета в базу данных
-        projects = db.get_projects()
-        if projects:
-            update.message.reply_text(
-                "🏗 Хотите привязать расчет к проекту?",
-                reply_markup=Keyboards.projects_keyboard(projects)
-            )
+        # Расчет сохраняется в базу, когда его привязывают к проекту
+        update.message.reply_text(result, reply_markup=Keyboards.main_menu('worker'))
+        if context.db.has_projects():
             context.user_data['calculation_result'] = (material_type, area, thickness, quantity)
-            return ConversationHandler.END
-        else:
-            update.message.reply_text(result, reply_markup=Keyboards.main_menu('worker'))
-            return ConversationHandler.END
+            SharedHandlers.send_project_picker(update, context, "🏗 Хотите привязать расчет к проекту?", action='link')
+        return ConversationHandler.END
     
     @staticmethod
     def link_calculation_to_project(update: Update, context: CallbackContext):
-        project_address = update.message.text[2:]  # Убираем эмодзи
-        projects = db.get_projects()
-        
-        for project in projects:
-            if project['address'] == project_address:
-                material_type, area, thickness, quantity = context.user_data['calculation_result']
-                
-                db.add_calculation(
-                    update.effective_user.id,
-                    project['project_id'],
-                    material_type,
-                    area,
-                    thickness,
-                    quantity
-                )
-                
-                result = MaterialCalculator.format_calculation_result(material_type, area, thickness, quantity)
-                update.message.reply_text(
-                    f"{result}\n\n✅ Расчет привязан к проекту: {project['address']}",
-                    reply_markup=Keyboards.main_menu('worker')
-                )
-                break
-        
+        # Состояние диалога меняем в потоке диспетчера, запись и ответ - в пуле
+        calculation = context.user_data.get('calculation_result')
         context.user_data.clear()
+        if calculation is None:
+            # Кнопка из старого списка: расчет уже привязан или сделан новый
+            update.callback_query.answer("⚠️ Этот расчет уже привязан или устарел.")
+            return ConversationHandler.END
+        
+        WorkerHandlers._save_linked_calculation(update, context, calculation)
         return ConversationHandler.END
     
+    @staticmethod
+    @offload(db_executor)
+    def _save_linked_calculation(update: Update, context: CallbackContext, calculation):
+        project = SharedHandlers.selected_project(update, context)
+        if not project:
+            return
+        
+        material_type, area, thickness, quantity = calculation
+        write = context.db.add_calculation(
+            update.effective_user.id,
+            project['project_id'],
+            material_type,
+            area,
+            thickness,
+            quantity
+        )
+        # Подтверждаем только после фиксации в базе
+        try:
+            write.result()
+        except Exception as e:
+            logger.error(f"Error saving calculation for project {project['project_id']}: {e}")
+            update.effective_message.reply_text(
+                "❌ Не удалось сохранить расчет. Попробуйте выполнить его еще раз.",
+                reply_markup=Keyboards.main_menu('worker')
+            )
+            return
+        
+        update.effective_message.reply_text(
+            f"✅ Расчет привязан к проекту: {project['address']}",
+            reply_markup=Keyboards.main_menu('worker')
+        )
+    
     @staticmethod
     def cancel_calculation(update: Update, context: CallbackContext):
         update.message.reply_text(
@@ -154,50 +163,44 @@ class WorkerHandlers:
     
     @staticmethod
     def show_projects_list(update: Update, context: CallbackContext):
-        projects = db.get_projects()
-        if not projects:
-            update.message.reply_text("📭 Нет доступных проектов.")
-            return
-        
-        update.message.reply_text(
-            "🏗 Выберите проект:",
-            reply_markup=Keyboards.projects_keyboard(projects)
-        )
+        SharedHandlers.send_project_picker(update, context, "🏗 Выберите проект:")
     
     @staticmethod
     def show_project_details(update: Update, context: CallbackContext):
-        project_address = update.message.text[2:]  # Убираем эмодзи
-        projects = db.get_projects()
-        
-        for project in projects:
-            if project['address'] == project_address:
-                message = (f"🏠 Адрес: {project['address']}\n"
-                          f"📅 Дата создания: {project['created_at']}\n"
-                          f"👤 Ответственный: {project['first_name']} {project['last_name']}\n"
-                          f"📝 Описание: {project['description']}")
-                
-                update.message.reply_text(
-                    message,
-                    reply_markup=Keyboards.project_details_keyboard(project['project_id'])
-                )
-                break
+        SharedHandlers.close_project_picker(context)
+        WorkerHandlers._send_project_details(update, context)
+    
+    @staticmethod
+    @offload(db_executor)
+    def _send_project_details(update: Update, context: CallbackContext):
+        project = SharedHandlers.selected_project(update, context)
+        if not project:
+            update.effective_message.reply_text("❌ Проект не найден.")
+            return
+        
+        message = (f"🏠 Адрес: {project['address']}\n"
+                  f"📅 Дата создания: {project['created_at']}\n"
+                  f"👤 Ответственный: {project['first_name']} {project['last_name']}\n"
+                  f"📝 Описание: {project['description']}")
+        
+        update.effective_message.reply_text(
+            message,
+            reply_markup=Keyboards.project_details_keyboard(project['project_id'])
+        )
     
     @staticmethod
+    @offload(io_executor)
     def project_details_callback(update: Update, context: CallbackContext):
         query = update.callback_query
         query.answer()
         
-        action, project_id = query.data.split('_')
-        project = db.get_project(project_id)
+        parts = query.data.split('_')
+        action, project_id = parts[0], int(parts[1])
+        project = context.db.get_project(project_id)
         
         if action == 'design':
             try:
-                with open(project['design_pdf_path'], 'rb') as file:
-                    context.bot.send_document(
-                        chat_id=query.message.chat_id,
-                        document=file,
-                        caption=f"📄 Дизайн-проект для {project['address']}"
-                    )
+                SharedHandlers.send_project_design(context, query.message.chat_id, project)
             except Exception as e:
                 logger.error(f"Error sending design file: {e}")
                 query.edit_message_text("❌ Ошибка при загрузке файла.")
@@ -205,32 +208,37 @@ class WorkerHandlers:
         elif action == 'lock':
             query.edit_message_text(f"🔑 Код замка для {project['address']}: {project['lock_code']}")
         
+        elif action == 'totals':
+            query.edit_message_text(SharedHandlers.project_totals_text(context, project))
+        
         elif action == 'calculations':
-            calculations = db.get_user_calculations(update.effective_user.id)
+            before_id = int(parts[2]) if len(parts) > 2 else None
+            page_size = Config.CALCULATIONS_PAGE_SIZE
+            calculations = context.db.get_project_calculations(
+                project_id, user_id=update.effective_user.id, before_id=before_id, limit=page_size + 1
+            )
             if not calculations:
                 query.edit_message_text("📭 Нет расчетов для этого проекта.")
                 return
             
+            next_before_id = None
+            if len(calculations) > page_size:
+                calculations = calculations[:page_size]
+                next_before_id = calculations[-1]['calculation_id']
+            
+            catalog = get_catalog()
             calc_list = "\n".join(
-                [f"🧱 {c['material_type']} - {c['quantity']} {Config.MATERIALS[c['material_type'].lower()]['unit']} (Площадь: {c['area']} м²)"
-                 for c in calculations if c['project_id'] == int(project_id)]
+                [f"🧱 {c['material_type']} - {c['quantity']} {catalog.unit(c['material_type'])} (Площадь: {c['area']} м²)"
+                 for c in calculations]
             )
             
-            query.edit_message_text(f"📊 Ваши расчеты для {project['address']}:\n\n{calc_list}")
-    
-    @staticmethod
-    def show_messages(update: Update, context: CallbackContext):
-        user = update.effective_user
-        messages = db.get_user_messages(user.id)
-        
-        if not messages:
-            update.message.reply_text("📭 У вас нет новых сообщений.")
-            return
-        
-        for msg in messages[:5]:  # Показываем последние 5 сообщений
-            update.message.reply_text(f"📩 От {msg['sender_name']}:\n\n{msg['text']}")
+            query.edit_message_text(
+                f"📊 Ваши расчеты для {project['address']}:\n\n{calc_list}",
+                reply_markup=Keyboards.calculations_page_keyboard(project_id, before_id, next_before_id)
+            )
     
     @staticmethod
+    @offload(db_executor)
     def send_message_to_admin(update: Update, context: CallbackContext):
         if len(context.args) < 1:
             update.message.reply_text("❌ Использование: /message ваш текст сообщения")
@@ -238,15 +246,14 @@ class WorkerHandlers:
         
         message_text = ' '.join(context.args)
         worker = update.effective_user
+        text = f"📩 Сообщение от работника {worker.first_name} {worker.last_name} (@{worker.username}):\n\n{message_text}"
         
-        for admin_id in Config.ADMIN_IDS:
-            try:
-                context.bot.send_message(
-                    admin_id,
-                    f"📩 Сообщение от работника {worker.first_name} {worker.last_name} (@{worker.username}):\n\n{message_text}"
-                )
-            except Exception as e:
-                logger.error(f"Error sending message to admin {admin_id}: {e}")
+        # Каждому администратору - своя строка во входящих и свое уведомление в outbox, в одной транзакции
+        writes = [context.db.add_message(worker.id, admin_id, message_text, [notification(admin_id, text)])
+                  for admin_id in Config.ADMIN_IDS]
+        # Подтверждаем работнику, только когда сообщение записано на диск
+        for write in writes:
+            write.result()
+        context.bot_data['outbox'].wake()
         
-        db.add_message(worker.id, admin_id, message_text)
         update.message.reply_text("✅ Ваше сообщение отправлено администратору.")
\ No newline at end of file
@@ -0,0 +1,124 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindQueue:
+    """Отложенная запись в базу с групповой фиксацией.
+    
+    Операции копятся в очереди; фоновый поток забирает до max_batch операций,
+    но ждет не дольше max_delay секунд после первой, и выполняет их одной
+    транзакцией - один COMMIT и один fsync на пачку вместо одного на строку.
+    Транзакция фиксируется с synchronous=FULL: когда future операции завершен,
+    запись переживет и падение процесса, и отключение питания.
+    """
+    
+    def __init__(self, connect, max_delay=Config.WRITE_BEHIND_DELAY, max_batch=Config.WRITE_BEHIND_BATCH,
+                 max_queue=Config.WRITE_BEHIND_QUEUE, retry_base=Config.WRITE_BEHIND_RETRY_BASE,
+                 retry_max=Config.WRITE_BEHIND_RETRY_MAX):
+        self._connect = connect
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        # Очередь ограничена: при переполнении submit ждет писателя
+        self._queue = queue.Queue(max_queue)
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+    
+    def submit(self, write):
+        """Ставит write(conn) в очередь. Возвращает Future с результатом write после COMMIT"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            self._queue.put((write, future))
+        return future
+    
+    def flush(self, timeout=None):
+        """Ждет фиксации всех операций, поставленных до вызова"""
+        self.submit(lambda conn: None).result(timeout)
+    
+    def close(self):
+        """Перестает принимать операции, фиксирует оставшиеся и останавливает поток"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        conn = self._connect()
+        conn.execute('PRAGMA synchronous=FULL')
+        try:
+            stop = False
+            while not stop:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._commit(conn, batch)
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _is_busy(error):
+        # Блокировку держит другой писатель (rebuild, миграции, другой процесс) - операции не виноваты
+        message = str(error)
+        return isinstance(error, sqlite3.OperationalError) and (
+            'database is locked' in message or 'database is busy' in message
+        )
+    
+    def _commit(self, conn, batch):
+        delay = self.retry_base
+        while True:
+            started = time.perf_counter()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                results = [write(conn) for write, _ in batch]
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                metrics.observe('db', 'write_behind_commit', time.perf_counter() - started, error=True)
+                if self._is_busy(e):
+                    # Повторяем всю пачку, пока база не освободится: строки не теряются
+                    logger.warning(f"Write-behind batch of {len(batch)} hit a locked database, retrying in {delay:.2f}s")
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.retry_max)
+                    continue
+                if len(batch) == 1:
+                    logger.error(f"Write-behind operation failed: {e}")
+                    batch[0][1].set_exception(e)
+                    return
+                # Ошибочная операция не должна отменять остальные - повторяем по одной
+                logger.warning(f"Write-behind batch of {len(batch)} failed ({e}), retrying one by one")
+                for item in batch:
+                    self._commit(conn, [item])
+                return
+            break
+        
+        metrics.observe('db', 'write_behind_commit', time.perf_counter() - started)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
\ No newline at end of file